@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive Monte Carlo estimates
+
+Simulates in batches until the confidence interval of a mean is narrower
+than a target half-width. After each batch the sample variance gives the
+number of games still needed, so low-variance estimates stop early and the
+simulations go where they matter.
+"""
+from collections import namedtuple
+from math import ceil, sqrt
+from statistics import NormalDist
+import numpy as np
+
+from parallel import iter_sharded, SHARD_SIZE
+
+# mean of the per-game values, half-width of its confidence interval and
+# number of games simulated
+Estimate = namedtuple('Estimate', ['mean', 'half_width', 'n'])
+
+
+def sequential_estimate(task, half_width, args = (), transform = None,
+                        seed = None, workers = 1, confidence = 0.95,
+                        min_n = 2 * SHARD_SIZE, max_n = 10**6):
+    '''
+    task -- function called as in parallel.run_sharded
+    half_width -- (float) target half-width of the confidence interval
+    args -- (tuple) leading arguments for task
+    transform -- function mapping an array of task results to the values
+                 that are averaged, defaults to the results themselves
+    seed -- master seed, the games are the same as in a seeded run_sharded
+    confidence -- (float) confidence level of the interval
+    min_n -- (int) games simulated before the variance is trusted
+    max_n -- (int) stop here even if the target isn't reached
+
+    returns an Estimate
+    '''
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    values = np.empty(0)
+    n = ceil(min_n / SHARD_SIZE) * SHARD_SIZE
+
+    while True:
+        shards = iter_sharded(task, min(n, max_n), args, seed, workers,
+                              skip = len(values))
+        new = np.array([res for shard in shards for res in shard])
+        if transform is not None:
+            new = transform(new)
+        values = np.concatenate([values, new])
+
+        std = np.std(values, ddof = 1)
+        error = z * std / sqrt(len(values))
+        if error <= half_width or len(values) >= max_n:
+            return Estimate(float(np.mean(values)), float(error), len(values))
+
+        # games needed at the current variance, growing at most 4x per batch
+        # so a poor early variance estimate can't overshoot by much
+        needed = ceil((z * std / half_width) ** 2)
+        n = min(max(needed, len(values) + SHARD_SIZE), 4 * len(values))
+        n = ceil(n / SHARD_SIZE) * SHARD_SIZE
+
+
+# means of two paired arms, their mean difference (b - a) with its standard
+# error, and number of trials
+Comparison = namedtuple('Comparison', ['mean_a', 'mean_b', 'difference', 
+                                       'se', 'n'])
+
+def paired_difference(pairs):
+    '''
+    pairs -- array of per-trial values (n x 2), both arms of a trial run on
+             common random numbers
+
+    returns a Comparison
+    '''
+    pairs = np.asarray(pairs, dtype = float)
+    diffs = pairs[:, 1] - pairs[:, 0]
+    se = np.std(diffs, ddof = 1) / sqrt(len(diffs))
+    return Comparison(float(pairs[:, 0].mean()), float(pairs[:, 1].mean()),
+                      float(diffs.mean()), float(se), len(diffs))
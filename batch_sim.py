@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized batch simulation of games with the Tron deck
+
+Simulates many games at once: each library is a row of integer card IDs,
+hands and battlefields are rows of card counts, and every game advances one
+play at a time using masked NumPy operations. Follows the same priority
+logic as vancouver.sim_turn, so the turn-to-Tron distribution matches
+vancouver.sim_magic.
+
+version 2.0: updated for Once Upon a Time
+"""
+import numpy as np
+
+import card_classes
+from card_classes import CARD_NAMES, CMC, GMC, AMC
+from card_classes import FOREST, EMAP, SCRYING, STIRRINGS, OUAT, STAR, \
+    SPHERE
+from vancouver import PRIORITY
+
+NUM_CARDS = len(CARD_NAMES)
+TRON = np.array(card_classes.TRON_IDS)
+LANDS = np.array(card_classes.LAND_IDS)
+
+# marks the Tron lands among all cards
+IS_TRON = np.zeros(NUM_CARDS, dtype = bool)
+IS_TRON[TRON] = True
+
+# libraries are stored as ring buffers, so cards put on the bottom wrap around
+# (slots outside the library hold EMPTY)
+RING = 64
+EMPTY = -1
+
+# Ancient Stirrings and Once Upon a Time pick priorities (lower is better)
+def _rank(priority):
+    rank = np.full(NUM_CARDS, len(priority))
+    rank[list(priority)] = np.arange(len(priority))
+    return rank
+
+STIRRINGS_RANK = _rank(card_classes.STIRRINGS_PRIORITY)
+OUAT_RANK = _rank(card_classes.OUAT_PRIORITY)
+
+# mana costs of each play in PRIORITY
+ACTION_COSTS = np.array([(AMC[cid], 0) if field == 'ability'
+                         else (CMC[cid], GMC[cid])
+                         for cid, field in PRIORITY])
+
+DECK = np.array(card_classes.DECK_IDS, dtype = np.int8)
+
+
+# state of a batch of games in play
+class GameBatch:
+
+    def __init__(self, n, handsize, rng, deck = None):
+        self.rng = rng
+
+        ids = DECK if deck is None else np.array(deck.ids, dtype = np.int8)
+        if len(ids) > RING:
+            raise ValueError('decks are limited to {0} cards'.format(RING))
+
+        # libraries are shuffled lazily, only as deep as the games read:
+        # cards from the top up to position 'shuffled' are in random order,
+        # the rest up to 'unshuffled' are still waiting to be shuffled
+        # (positions count up from the first card, and wrap around the ring)
+        self.lib = np.full((n, RING), EMPTY, dtype = np.int8)
+        self.lib[:, :len(ids)] = ids
+
+        # every game reads at least this deep, so shuffle it up front
+        # without the bookkeeping of the lazy path
+        depth = min(handsize + 6, len(ids))
+        lib = self.lib.reshape(-1)
+        start = np.arange(n) * RING
+        for i in range(depth):
+            b = start + i + (rng.random(n) * (len(ids) - i)).astype(np.int64)
+            card = self.lib[:, i].copy()
+            self.lib[:, i] = lib[b]
+            lib[b] = card
+
+        # hands and battlefields share one array, so a game's card counts
+        # can be gathered at once; deal the opening hands off the top
+        self._set_zones(np.zeros((n, 2 * NUM_CARDS), dtype = np.int8))
+        zones = self.zones.reshape(-1)
+        start = np.arange(n) * 2 * NUM_CARDS
+        for i in range(handsize):
+            zones[start + self.lib[:, i]] += 1
+        self.lib[:, :handsize] = EMPTY
+
+        self.top = np.full(n, handsize, dtype = np.int64)
+        self.size = np.full(n, len(ids) - handsize)
+        self.shuffled = np.full(n, depth, dtype = np.int64)
+        self.unshuffled = np.full(n, len(ids), dtype = np.int64)
+
+    # hand and bfield are views of the two halves of zones
+    def _set_zones(self, zones):
+        self.zones = zones
+        self.hand = zones[:, :NUM_CARDS]
+        self.bfield = zones[:, NUM_CARDS:]
+
+    # drop games that are finished
+    def keep(self, mask):
+        self.lib = self.lib[mask]
+        self.top = self.top[mask]
+        self.size = self.size[mask]
+        self.shuffled = self.shuffled[mask]
+        self.unshuffled = self.unshuffled[mask]
+        self._set_zones(self.zones[mask])
+
+    # runs the Fisher-Yates shuffle down to the given depth of the library
+    def randomize(self, rows, depth):
+        top = self.top[rows]
+        start = np.maximum(self.shuffled[rows], top)
+        end = self.unshuffled[rows]
+        steps = np.minimum(top + depth, end) - start
+        more = steps > 0
+        rows, start, end, steps = rows[more], start[more], end[more], \
+            steps[more]
+        if len(rows) == 0:
+            return
+        self.shuffled[rows] = start + steps
+
+        # swap on the flattened libraries, which is faster than 2D indexing
+        lib = self.lib.reshape(-1)
+        base = rows * RING
+        for i in range(steps.max()):
+            if i:
+                more = steps > i
+                base, start, end, steps = base[more], start[more], \
+                    end[more], steps[more]
+            pos = start + i
+            swap = pos + (self.rng.random(len(base))
+                          * (end - pos)).astype(np.int64)
+            a = base + (pos & (RING - 1))
+            b = base + (swap & (RING - 1))
+            card = lib[a]
+            lib[a] = lib[b]
+            lib[b] = card
+
+    # removes the top n cards of the library, returns their slots
+    def _take_top(self, rows, n):
+        self.randomize(rows, n)
+        top = self.top[rows]
+        self.top[rows] = top + n
+        self.size[rows] -= n
+        return top & (RING - 1)
+
+    def draw(self, rows):
+        pos = rows * RING + self._take_top(rows, 1)
+        lib = self.lib.reshape(-1)
+        self.zones.reshape(-1)[rows * 2 * NUM_CARDS + lib[pos]] += 1
+        lib[pos] = EMPTY
+
+    # Tron lands that are neither in play nor in hand
+    def _tron_wanted(self, rows):
+        zones = self.zones.reshape(-1)
+        at = rows[:, None] * 2 * NUM_CARDS + TRON
+        needed = zones[at + NUM_CARDS] == 0
+        in_hand = zones[at] > 0
+        return needed, in_hand
+
+    # look at the top five cards, take one, put the rest on the bottom
+    def dig(self, rows, rank):
+        lib = self.lib.reshape(-1)
+        at = rows[:, None] * RING + ((self._take_top(rows, 5)[:, None]
+                                      + np.arange(5)) & (RING - 1))
+        temp = lib[at]
+        lib[at] = EMPTY
+
+        # prefer a needed Tron land that isn't already in hand,
+        # otherwise take the best card by priority, if any
+        zones = self.zones.reshape(-1)
+        count_at = rows[:, None] * 2 * NUM_CARDS + temp
+        tron_hit = IS_TRON[temp] & (zones[count_at] == 0) \
+            & (zones[count_at + NUM_CARDS] == 0)
+        ranks = np.where(tron_hit, -1, rank[temp])
+        pick = ranks.argmin(axis = 1)
+        took = ranks.min(axis = 1) < rank.max()
+        zones[count_at[took, pick[took]]] += 1
+
+        # remaining cards go to the bottom in the same order, closing the
+        # gap left by the pick (the slot past the new bottom stays EMPTY)
+        rest = np.where(np.arange(4) < pick[:, None], temp[:, :4], temp[:, 1:])
+        bottom = self.top[rows] + self.size[rows]
+        at = rows[:, None] * RING + ((bottom[:, None] + np.arange(5))
+                                     & (RING - 1))
+        lib[at[:, :4]] = np.where(took[:, None], rest, temp[:, :4])
+        lib[at[:, 4]] = np.where(took, EMPTY, temp[:, 4])
+        self.size[rows] += 5 - took
+
+    # fetch a missing Tron land to hand, then shuffle the library
+    def tutor(self, rows):
+        needed, in_hand = self._tron_wanted(rows)
+        wanted = needed & ~in_hand
+        found = wanted.any(axis = 1)
+        target = TRON[wanted.argmax(axis = 1)]
+
+        # move the top card into the tutored card's slot, then take the top
+        hit = rows[found]
+        target = target[found]
+        pos = (self.lib[hit] == target[:, None]).argmax(axis = 1)
+        top = self.top[hit]
+        lib = self.lib.reshape(-1)
+        slot = hit * RING + (top & (RING - 1))
+        lib[hit * RING + pos] = lib[slot]
+        lib[slot] = EMPTY
+        self.zones.reshape(-1)[hit * 2 * NUM_CARDS + target] += 1
+        self.top[hit] = top + 1
+        self.size[hit] -= 1
+
+        # shuffling only marks the whole library as waiting to be shuffled
+        top = self.top[rows]
+        self.shuffled[rows] = top
+        self.unshuffled[rows] = top + self.size[rows]
+
+
+# applies the play chosen from PRIORITY to a set of games
+def _apply(games, action, rows, manapool, g_mana, land_drop):
+
+    cid, field = PRIORITY[action]
+    cmc, gmc = ACTION_COSTS[action]
+    manapool[rows] -= cmc
+    g_mana[rows] -= gmc
+
+    if field == 'ability':
+        games.bfield[rows, cid] -= 1
+        if cid == EMAP:
+            games.tutor(rows)
+        else:
+            games.draw(rows)
+        # Chromatic Star/Sphere add a green mana
+        if cid in (STAR, SPHERE):
+            manapool[rows] += 1
+            g_mana[rows] += 1
+
+    elif field == 'cast':
+        games.hand[rows, cid] -= 1
+        if cid == SCRYING:
+            games.tutor(rows)
+        elif cid == STIRRINGS:
+            games.dig(rows, STIRRINGS_RANK)
+        else:
+            games.bfield[rows, cid] += 1
+
+    else:
+        games.hand[rows, cid] -= 1
+        games.bfield[rows, cid] += 1
+        land_drop[rows] = True
+        manapool[rows] += 1
+        if cid == FOREST:
+            g_mana[rows] += 1
+
+
+# simulates one turn for the given games, returns a mask of games with Tron
+def batch_turn(games, turn, games_in_play):
+
+    n = len(games.top)
+    manapool = games.bfield[:, LANDS].sum(axis = 1).astype(np.int16)
+    g_mana = games.bfield[:, FOREST].astype(np.int16)
+    land_drop = np.zeros(n, dtype = bool)
+    tron = np.zeros(n, dtype = bool)
+
+    # cast Once Upon a Time for free
+    if turn == 0:
+        rows = games_in_play[games.hand[games_in_play, OUAT] > 0]
+        games.hand[rows, OUAT] -= 1
+        games.dig(rows, OUAT_RANK)
+
+    # continue until no plays are available
+    live = games_in_play
+    while len(live):
+
+        zones = games.zones[live]
+        hand = zones[:, :NUM_CARDS]
+        bfield = zones[:, NUM_CARDS:]
+
+        # Tron lands in play and playable from hand, one column at a time,
+        # which is faster than reducing over short rows
+        tower, mine, pplant = (bfield[:, cid] > 0 for cid in TRON)
+        assembled = tower & mine & pplant
+        one_short = (tower & mine) | (tower & pplant) | (mine & pplant)
+        done = assembled & (manapool[live] >= 3)
+
+        # play a tron land from hand if already available; only the batch
+        # is updated, this pass has no other use for the dropped land
+        playable = [~in_play & (hand[:, cid] > 0)
+                    for cid, in_play in zip(TRON, (tower, mine, pplant))]
+        drop = (playable[0] | playable[1] | playable[2]) \
+            & ~land_drop[live] & ~done
+        drop_at = np.flatnonzero(drop)
+        rows = live[drop_at]
+        land = TRON[np.where(playable[0][drop_at], 0,
+                             np.where(playable[1][drop_at], 1, 2))]
+        at = rows * 2 * NUM_CARDS + land
+        games.zones.reshape(-1)[at] -= 1
+        games.zones.reshape(-1)[at + NUM_CARDS] += 1
+        manapool[rows] += 1
+        land_drop[rows] = True
+
+        done[drop_at] = one_short[drop_at] & (manapool[rows] >= 3)
+        tron[live[done]] = True
+
+        # play a card and return to the top of the loop
+        mana = manapool[live]
+        green = g_mana[live]
+        no_drop = ~land_drop[live]
+        afford = {}
+
+        # later entries are overwritten by earlier ones, using arithmetic
+        # rather than masked writes, which are much slower
+        choice = np.full(len(live), -1, dtype = np.int8)
+        for i in range(len(PRIORITY) - 1, -1, -1):
+            cid, field = PRIORITY[i]
+            cost = tuple(ACTION_COSTS[i])
+            if cost not in afford:
+                afford[cost] = (mana >= cost[0]) & (green >= cost[1])
+            if field == 'ability':
+                legal = (bfield[:, cid] > 0) & afford[cost]
+            elif field == 'cast':
+                legal = (hand[:, cid] > 0) & afford[cost]
+            else:
+                legal = (hand[:, cid] > 0) & no_drop
+            choice -= legal * (choice - np.int8(i))
+        choice[done] = -1
+
+        # group the games by play (a stable sort of int8 is a radix sort)
+        order = live[np.argsort(choice, kind = 'stable')]
+        ends = np.cumsum(np.bincount(choice + 1,
+                                     minlength = len(PRIORITY) + 1))
+        for action in np.flatnonzero(ends[1:] > ends[:-1]):
+            rows = order[ends[action]:ends[action + 1]]
+            _apply(games, action, rows, manapool, g_mana, land_drop)
+
+        live = live[choice >= 0]
+
+    return tron[games_in_play]
+
+
+def sim_batch(n, handsize, on_draw, rng = None, deck = None):
+    '''
+    n: number of games to simulate (int)
+    handsize: starting handsize (int)
+    on_draw: boolean
+    rng: numpy Generator, defaults to a freshly seeded one
+    deck: card_classes.Deck to play, defaults to the Tron deck list
+
+    returns the starting hands as card counts (n x NUM_CARDS)
+    and the turn each game achieved Tron
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+
+    games = GameBatch(n, handsize, rng, deck)
+    starting_hands = games.hand.copy()
+
+    turns = np.zeros(n, dtype = np.int16)
+    alive = np.arange(n)
+    rows = np.arange(n)
+    turn = 0
+
+    # simulates playing until Tron is in play
+    while len(alive):
+
+        if on_draw or turn != 0:
+            games.draw(rows)
+
+        tron = batch_turn(games, turn, rows)
+        turns[alive[tron]] = turn + 1
+        alive = alive[~tron]
+        rows = rows[~tron]
+
+        # only pay for compacting the batch once most games are finished
+        if len(rows) < len(games.top) // 4:
+            keep = np.zeros(len(games.top), dtype = bool)
+            keep[rows] = True
+            games.keep(keep)
+            rows = np.arange(len(rows))
+        turn += 1
+
+    return starting_hands, turns
+
+
+# converts starting hands from card counts to lists of card names
+def hand_names(counts):
+    return [[CARD_NAMES[cid] for cid in np.repeat(np.arange(NUM_CARDS), row)]
+            for row in counts]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the simulator, featurization and model inference
+
+Each benchmark runs a fixed, seeded workload a few times and keeps the best
+rate (games, hands, rows or openers per second). Results are saved as JSON,
+and compared against a saved baseline: any rate that dropped by more than
+the threshold is reported as a regression.
+
+    python benchmarks.py --save-baseline    # on the reference commit
+    python benchmarks.py                    # later, compares to it
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+import batch_sim
+import card_classes
+from card_classes import TronDeck
+import compiled_forest
+import features
+import london
+import mulligan_sim
+import vancouver
+
+BASELINE_FILE = 'benchmarks_baseline.json'
+RESULTS_FILE = 'benchmarks.json'
+# compiled model used when london's own model hasn't been compiled yet
+MODEL_FILE = 'benchmark_forest.npz'
+
+# a drop in rate larger than this fraction is a regression
+THRESHOLD = 0.10
+
+
+# 7 card openers from a seeded deck, as Zones of card IDs
+def _openers(n, seed = 0):
+    rng = random.Random(seed)
+    return [TronDeck(rng).draw_opener(7) for i in range(n)]
+
+def _opener_names(n, seed = 0):
+    return [[card.name for card in hand] for hand in _openers(n, seed)]
+
+
+# model for london.best_hand: the compiled London model if there is one,
+# otherwise a forest with the same settings trained on seeded games
+def benchmark_model():
+    if os.path.exists(compiled_forest.FOREST_FILE):
+        return london.get_model()
+    if not os.path.exists(MODEL_FILE):
+        import model_turns
+        data = model_turns.sim_features(7, True, 5000,
+                                        random.Random(0))
+        model = model_turns.fit_random_forest(data[:, :-1], data[:, -1])
+        compiled_forest.compile_forest(model).save(MODEL_FILE)
+    return compiled_forest.load_forest(MODEL_FILE)
+
+
+# each benchmark prepares its inputs and returns (number of items, function
+# doing the timed work)
+
+def bench_sim_magic():
+    n = 2000
+    return n, lambda: vancouver.sim_game_turns(7, False, n, random.Random(0))
+
+def bench_sim_batch():
+    n = 100000
+    return n, lambda: batch_sim.sim_batch(n, 7, False,
+                                          np.random.default_rng(0))
+
+def bench_eval_tron_hand():
+    openers = _openers(20000)
+    return len(openers), lambda: [mulligan_sim.eval_tron_hand(hand, 7)
+                                  for hand in openers]
+
+def bench_encode_hands():
+    hands = _opener_names(20000)
+    return len(hands), lambda: features.encode_hands(hands, True)
+
+def bench_sim_features():
+    import model_turns
+    n = 2000
+    return n, lambda: model_turns.sim_features(7, True, n, random.Random(0))
+
+def bench_best_hand():
+    model = benchmark_model()
+    openers = _opener_names(200)
+    return len(openers), lambda: [london.best_hand(hand, 6, True, model)
+                                  for hand in openers]
+
+# name: (unit, benchmark)
+BENCHMARKS = {
+    'sim_magic': ('games/s', bench_sim_magic),
+    'sim_batch': ('games/s', bench_sim_batch),
+    'eval_tron_hand': ('hands/s', bench_eval_tron_hand),
+    'encode_hands': ('rows/s', bench_encode_hands),
+    'sim_features': ('rows/s', bench_sim_features),
+    'best_hand': ('openers/s', bench_best_hand),
+}
+
+
+def run_benchmarks(names = None, repeat = 3):
+    '''
+    names -- benchmarks to run (keys of BENCHMARKS), defaults to all
+    repeat -- (int) timed runs of each workload, the fastest is kept
+
+    returns {'environment': {...}, 'results': {name: {'unit', 'rate',
+    'items', 'seconds'}}}
+    '''
+    if names is None:
+        names = list(BENCHMARKS)
+
+    results = {}
+    for name in names:
+        unit, bench = BENCHMARKS[name]
+        items, work = bench()
+        best = min(_timed(work) for i in range(repeat))
+        results[name] = {'unit': unit, 'rate': items / best,
+                         'items': items, 'seconds': best}
+        print('{0:<16} {1:>14,.0f} {2}'.format(name, items / best, unit))
+
+    environment = {'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.machine(),
+                   'deck': card_classes.DEFAULT_DECK.digest}
+    return {'environment': environment, 'results': results}
+
+def _timed(work):
+    start = time.perf_counter()
+    work()
+    return time.perf_counter() - start
+
+
+def compare(results, baseline, threshold = THRESHOLD):
+    '''
+    results, baseline -- outputs of run_benchmarks
+    threshold -- (float) largest allowed drop in rate, as a fraction
+
+    returns [(name, baseline rate, rate, relative change)] for every
+    benchmark in both, and prints them with the regressions flagged
+    '''
+    changes = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['rate']
+        change = result['rate'] / old - 1
+        changes.append((name, old, result['rate'], change))
+        flag = 'REGRESSION' if change < -threshold else ''
+        print('{0:<16} {1:>14,.0f} -> {2:>14,.0f} {3:>+7.1%} {4}'.format(
+                name, old, result['rate'], change, flag))
+    return changes
+
+# the comparisons that are regressions
+def regressions(changes, threshold = THRESHOLD):
+    return [change for change in changes if change[3] < -threshold]
+
+
+def save(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent = 1)
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('names', nargs = '*', help = 'benchmarks to run '
+                        '({0})'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--output', default = RESULTS_FILE)
+    parser.add_argument('--baseline', default = BASELINE_FILE)
+    parser.add_argument('--save-baseline', action = 'store_true',
+                        help = 'save the results as the new baseline')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names or None, args.repeat)
+    save(results, args.output)
+
+    if args.save_baseline:
+        save(results, args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline to compare to, save one with --save-baseline')
+        return 0
+
+    print('compared to', args.baseline)
+    changes = compare(results, load(args.baseline), args.threshold)
+    return 1 if regressions(changes, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,20 +3,111 @@
 """
 Classes for the Tron deck, and cards within the deck.
 
+Each card is created once and registered with a small integer ID. Libraries
+are arrays of card IDs, and hands and battlefields are Zones that count the
+copies of each card ID.
+
 version 2.0: updated for Once Upon a Time
 """
 
+from array import array
+from collections import namedtuple
+import csv
+import hashlib
+import os
 import random
 
-# helper funtion to get names of cards in bfield
-def tron_check(bfield):
+# card registry: card objects and their fixed attributes, indexed by card ID
+CARDS = []
+CARD_IDS = {}
+CARD_NAMES = []
+CMC = []
+GMC = []
+AMC = []
+CARD_TYPE = []
+
+# adds a card to the registry and assigns its card ID
+def register(card):
+
+    card.cid = len(CARDS)
+    CARDS.append(card)
+    CARD_IDS[card.name] = card.cid
+    CARD_NAMES.append(card.name)
+    CMC.append(card.cmc)
+    GMC.append(card.gmc)
+    AMC.append(getattr(card, 'amc', 0))
+    CARD_TYPE.append(card.card_type)
+    return card
+
+# helper funtion to get the IDs of Tron lands missing from a zone
+def tron_check(zone):
     
-    bfield_names = {}
-    for card in bfield:
-        bfield_names[card.name] = bfield_names.get(card.name, 0) + 1
+    return zone.missing_tron()
     
-    tron_set = set(['Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant'])
-    return tron_set.difference(bfield_names)
+# a hand or battlefield, stored as the number of copies of each card ID
+class Zone:
+
+    __slots__ = ('counts',)
+
+    def __init__(self, cids = ()):
+        self.counts = [0] * len(CARDS)
+        for cid in cids:
+            self.add(cid)
+
+    def add(self, cid):
+        self.counts[cid] += 1
+
+    def remove(self, cid):
+        self.counts[cid] -= 1
+
+    def __contains__(self, cid):
+        return self.counts[cid] > 0
+
+    def __len__(self):
+        return sum(self.counts)
+
+    # iterates over the cards in the zone, in card ID order
+    def __iter__(self):
+        for cid, num in enumerate(self.counts):
+            for i in range(num):
+                yield CARDS[cid]
+
+    def missing_tron(self):
+        return [cid for cid in TRON_IDS if not self.counts[cid]]
+
+    def num_lands(self):
+        return sum(self.counts[cid] for cid in LAND_IDS)
+
+# the battlefield, which keeps the state needed for Tron up to date as cards
+# enter and leave instead of rescanning the zone
+class Battlefield(Zone):
+
+    __slots__ = ('tron_missing', 'lands', 'green_sources')
+
+    def __init__(self, cids = ()):
+        self.tron_missing = TRON_MASK # bitmask of missing Tron lands
+        self.lands = 0
+        self.green_sources = 0
+        Zone.__init__(self, cids)
+
+    def add(self, cid):
+        self.counts[cid] += 1
+        self.tron_missing &= ~TRON_BIT[cid]
+        self.lands += IS_LAND[cid]
+        self.green_sources += IS_GREEN_SOURCE[cid]
+
+    def remove(self, cid):
+        self.counts[cid] -= 1
+        if not self.counts[cid]:
+            self.tron_missing |= TRON_BIT[cid]
+        self.lands -= IS_LAND[cid]
+        self.green_sources -= IS_GREEN_SOURCE[cid]
+
+    def missing_tron(self):
+        return MISSING_TRON[self.tron_missing]
+
+    def num_lands(self):
+        return self.lands
 
 # generic Magic Card class
 class MagicCard:
@@ -37,8 +128,8 @@ class Land(MagicCard):
         MagicCard.__init__(self, name, 0, 'land', True, 0)
     
     def play(self, hand, bfield):
-        bfield.append(self)
-        hand.pop(hand.index(self))
+        bfield.add(self.cid)
+        hand.remove(self.cid)
         
 # class to simulate casting Ancient Stirrings
 class AncientStirrings(MagicCard):
@@ -48,41 +139,30 @@ class AncientStirrings(MagicCard):
 
     def cast(self, hand, deck, bfield):
 
-        # determine which lands are still needed for Tron
-        tron_needed = tron_check(bfield)
-        
         # look at the top five cards of the deck
-        temp = deck.deck[:5]
+        temp = deck.take_top(5)
         
         # selects a Tron land to add to hand, if available
-        for card in temp:
-            if card.name in tron_needed and card not in hand:
-                hand.append(card)
-                temp.pop(temp.index(card))
+        # (only lands that are still needed for Tron)
+        for cid in temp:
+            if TRON_BIT[cid] & bfield.tron_missing and cid not in hand:
+                hand.add(cid)
+                temp.remove(cid)
                 break
 
         # selecting another card if no new Tron lands in top 5 cards
-        temp_names = {card.name:temp.index(card) for card in temp}
-
         # coded to prioritize achieving Tron over all else
-        priority = ('Expedition Map', 'Chromatic Star', 'Chromatic Sphere', 
-                    'Forest', 'Urza\'s Tower', 'Urza\'s Mine', 
-                    'Urza\'s Power Plant','Sanctum of Ugin', 'Ghost Quarter')
-        
         if len(temp) == 5:
-            for name in priority:
-                if name in temp_names:
-                    hand.append(temp[temp_names[name]])
-                    temp.pop(temp_names[name])
+            for cid in STIRRINGS_PRIORITY:
+                if cid in temp:
+                    hand.add(cid)
+                    temp.remove(cid)
                     break
                 
-        # remove the top five cards of the deck
-        del deck.deck[:5]
-        
         # put the remaining 4 cards on the bottom of the deck
-        deck.deck.extend(temp)
+        deck.put_bottom(temp)
         
-        hand.pop(hand.index(self))
+        hand.remove(self.cid)
 
 
 # class to simulate casting Once Upon a Time
@@ -93,40 +173,30 @@ class OUaT(MagicCard):
     
     def cast(self, hand, deck, bfield):
         
-        # determine which lands are still needed for Tron
-        tron_needed = tron_check(bfield)
-        
         # look at the top five cards of the deck
-        temp = deck.deck[:5]
+        temp = deck.take_top(5)
         
         # selects a Tron land to add to hand, if available
-        for card in temp:
-            if card.name in tron_needed and card not in hand:
-                hand.append(card)
-                temp.pop(temp.index(card))
+        # (only lands that are still needed for Tron)
+        for cid in temp:
+            if TRON_BIT[cid] & bfield.tron_missing and cid not in hand:
+                hand.add(cid)
+                temp.remove(cid)
                 break
 
         # selecting another card if no new Tron lands in top 5 cards
-        temp_names = {card.name:temp.index(card) for card in temp}
-
         # coded to prioritize achieving Tron over all else
-        priority = ('Forest', 'Urza\'s Tower', 'Urza\'s Mine', 
-                    'Urza\'s Power Plant','Sanctum of Ugin', 'Ghost Quarter')
-        
         if len(temp) == 5:
-            for name in priority:
-                if name in temp_names:
-                    hand.append(temp[temp_names[name]])
-                    temp.pop(temp_names[name])
+            for cid in OUAT_PRIORITY:
+                if cid in temp:
+                    hand.add(cid)
+                    temp.remove(cid)
                     break
                 
-        # remove the top five cards of the deck
-        del deck.deck[:5]
-        
         # put the remaining cards on the bottom of the deck
-        deck.deck.extend(temp)
+        deck.put_bottom(temp)
         
-        hand.pop(hand.index(self))
+        hand.remove(self.cid)
         
         
         
@@ -139,12 +209,12 @@ class Chromatic(MagicCard):
         MagicCard.__init__(self, name, 1, 'artifact', True, 0)
         
     def cast(self, hand, deck, bfield):
-        bfield.append(self)
-        hand.pop(hand.index(self))
+        bfield.add(self.cid)
+        hand.remove(self.cid)
     
     def ability(self, hand, deck, bfield):
         deck.draw(hand)
-        bfield.pop(bfield.index(self))
+        bfield.remove(self.cid)
         
 
 # class to simulate casting and activating Relic of Progenitus
@@ -155,38 +225,24 @@ class Relic(MagicCard):
         MagicCard.__init__(self, 'Relic of Progenitus', 1, 'artifact', True, 0)
         
     def cast(self, hand, deck, bfield):
-        bfield.append(self)
-        hand.pop(hand.index(self))
+        bfield.add(self.cid)
+        hand.remove(self.cid)
    
     def ability(self, hand, deck, bfield):
         deck.draw(hand)
-        bfield.pop(bfield.index(self))
+        bfield.remove(self.cid)
 
    
     
 # helper function for Sylvan Scrying and Expedition Map
 def tron_tutor(hand, deck, bfield):
     
-    tron_set = set(['Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant'])
-    bfield_names = [card.name for card in bfield]
-    
-    # determine which Tron lands are still needed
-    tron_needed = list(tron_set.difference(set(bfield_names)))
-    hand_names = {card.name:0 for card in hand}
-    
     # move a Tron land from deck to hand (only tutors Tron lands)
-    for name in tron_needed:
-        if name not in hand_names:
-            names_deck = {card.name:i for i, card in enumerate(deck.deck)}
-    
-            # position of the card in the deck
-            card_pos = names_deck[name]
-            
-            # add the selected card to hand
-            hand.append(deck.deck[card_pos])
-            
-            # delete the card from the deck
-            deck.deck.pop(card_pos)
+    for cid in tron_check(bfield):
+        if cid not in hand:
+    
+            # add the selected card to hand, and delete it from the deck
+            hand.add(deck.tutor(cid))
             break
           
     deck.shuffle()
@@ -200,7 +256,7 @@ class SylvanScrying(MagicCard):
         
     def cast(self, hand, deck, bfield):
         tron_tutor(hand, deck, bfield)
-        hand.pop(hand.index(self))
+        hand.remove(self.cid)
         
         
 # class to simulate casting and activating Expedition Map  
@@ -211,75 +267,248 @@ class ExpMap(MagicCard):
         MagicCard.__init__(self, 'Expedition Map', 1, 'artifact', False, 0)
         
     def cast(self, hand, deck, bfield):
-        bfield.append(self)
-        hand.pop(hand.index(self))
+        bfield.add(self.cid)
+        hand.remove(self.cid)
     
     def ability(self, hand, deck, bfield):
         tron_tutor(hand, deck, bfield)
-        bfield.pop(bfield.index(self))
+        bfield.remove(self.cid)
+
 
+# every card the simulator knows, in card ID order
+TOWER = register(Land('Urza\'s Tower', False)).cid
+MINE = register(Land('Urza\'s Mine', False)).cid
+PPLANT = register(Land('Urza\'s Power Plant', False)).cid
+FOREST = register(Land('Forest', True)).cid
+GQ = register(Land('Ghost Quarter', False)).cid
+SANCTUM = register(Land('Sanctum of Ugin', False)).cid
+
+EMAP = register(ExpMap()).cid
+SCRYING = register(SylvanScrying()).cid
+STIRRINGS = register(AncientStirrings()).cid
+OUAT = register(OUaT()).cid
+STAR = register(Chromatic('Chromatic Star')).cid
+SPHERE = register(Chromatic('Chromatic Sphere')).cid
+RELIC = register(Relic()).cid
+
+# haymakers are treated as generic cards with no function
+KARN = register(MagicCard('Karn Liberated', 7, 'planeswalker', True, 0)).cid
+UGIN = register(MagicCard('Ugin, the Spirit Dragon', 8, 'planeswalker',
+                          True, 0)).cid
+ULAMOG = register(MagicCard('Ulamog, the Ceaseless Hunger', 10, 'creature',
+                            True, 0)).cid
+WURMCOIL = register(MagicCard('Wurmcoil Engine', 6, 'creature', True, 0)).cid
+BALLISTA = register(MagicCard('Walking Ballista', 0, 'creature', True, 0)).cid
+OSTONE = register(MagicCard('Oblivion Stone', 3, 'artifact', True, 0)).cid
+
+TRON_IDS = (TOWER, MINE, PPLANT)
+LAND_IDS = tuple(cid for cid, card_type in enumerate(CARD_TYPE)
+                 if card_type == 'land')
+
+# per card ID lookups used by Battlefield
+TRON_BIT = [0] * len(CARDS)
+for i, cid in enumerate(TRON_IDS):
+    TRON_BIT[cid] = 1 << i
+TRON_MASK = (1 << len(TRON_IDS)) - 1
+IS_LAND = [int(card_type == 'land') for card_type in CARD_TYPE]
+IS_GREEN_SOURCE = [int(cid == FOREST) for cid in range(len(CARDS))]
+
+# missing Tron land IDs for each bitmask
+MISSING_TRON = tuple(tuple(cid for i, cid in enumerate(TRON_IDS)
+                           if mask & (1 << i))
+                     for mask in range(TRON_MASK + 1))
+
+# cards picked by Ancient Stirrings and Once Upon a Time when no new Tron
+# land is available, in order of priority
+STIRRINGS_PRIORITY = (EMAP, STAR, SPHERE, FOREST, TOWER, MINE, PPLANT,
+                      SANCTUM, GQ)
+OUAT_PRIORITY = (FOREST, TOWER, MINE, PPLANT, SANCTUM, GQ)
+
+
+# deck lists are csv files with a name and count column
+DECK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decks',
+                         'tron.csv')
+
+# a deck list compiled for the simulator:
+#   ids -- card IDs of every card, sorted (array of bytes)
+#   counts -- copies of each card ID
+#   digest -- hash of the card counts, used to identify the deck
+Deck = namedtuple('Deck', ['ids', 'counts', 'digest'])
+
+# decks compiled so far, by digest
+_compiled = {}
+
+
+# reads a deck list file as {card name: copies}
+def read_decklist(path = DECK_FILE):
+    
+    decklist = {}
+    with open(path, newline = '') as file:
+        for row in csv.DictReader(file):
+            name = row['name'].strip()
+            decklist[name] = decklist.get(name, 0) + int(row['count'])
+    return decklist
+
+
+def compile_deck(decklist):
+    '''
+    decklist: {card name: copies}
+    
+    returns the Deck, compiled only once for the same card counts
+    '''
+    counts = [0] * len(CARDS)
+    for name, num in decklist.items():
+        if name not in CARD_IDS:
+            raise ValueError('unknown card: {0}'.format(name))
+        if num < 0:
+            raise ValueError('negative count for {0}'.format(name))
+        counts[CARD_IDS[name]] += num
+    
+    text = '\n'.join('{0},{1}'.format(CARD_NAMES[cid], num)
+                     for cid, num in enumerate(counts) if num)
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    
+    if digest not in _compiled:
+        ids = array('B', [cid for cid, num in enumerate(counts)
+                          for i in range(num)])
+        _compiled[digest] = Deck(ids, tuple(counts), digest)
+    return _compiled[digest]
+
+# reads and compiles a deck list file
+def load_deck(path = DECK_FILE):
+    return compile_deck(read_decklist(path))
+
+
+# the Tron deck list, used whenever no other deck is given
+DEFAULT_DECK = load_deck()
 
 # generates a Tron decklist
-def decklist():
-    
-    tower = Land('Urza\'s Tower', False)
-    mine = Land('Urza\'s Mine', False)
-    pplant = Land('Urza\'s Power Plant', False)
-    
-    sanctum = Land('Sanctum of Ugin', False)
-    gq = Land('Ghost Quarter', False)
-    forest = Land('Forest', True)
-    
-    # haymakers are treated as generic cards with no function
-    karn = MagicCard('Karn Liberated', 7, 'planeswalker', True, 0)
-    ugin = MagicCard('Ugin, the Spirit Dragon', 8, 'planeswalker', True, 0)
-    ulamog = MagicCard('Ulamog, the Ceaseless Hunger', 10, 'creature', True, 0)
-    wurmcoil = MagicCard('Wurmcoil Engine', 6, 'creature', True, 0)
-    ballista = MagicCard('Walking Ballista', 0, 'creature', True, 0)
-    ostone = MagicCard('Oblivion Stone', 3, 'artifact', True, 0)
-    
-    emap = ExpMap()
-    stirrings = AncientStirrings()
-    scrying = SylvanScrying()
-    ouat = OUaT()
-    star = Chromatic('Chromatic Star')
-    sphere = Chromatic('Chromatic Sphere')
-    relic = Relic()
-    
-    tron_lands = [tower, mine, pplant]*4
-    
-    
-    quads = [karn, wurmcoil, ballista, emap, stirrings, scrying, star, ouat]*4
-    trips = [sphere, ostone]*3
-    dups = [ulamog, ballista, ugin]
-    singles = [sanctum, gq]
-    forests = [forest]*4
-    
-    
-    return tron_lands + quads + trips + dups + singles + forests
+def decklist(deck = DEFAULT_DECK):
+    return [CARDS[cid] for cid in deck.ids]
 
+# the decklist as card IDs, built once and copied for each game
+DECK_IDS = DEFAULT_DECK.ids
 
-# class to simulate the library as a stack
+
+# class to simulate the library as a stack of card IDs
+# (a ring buffer read from 'top', with the positions of each card ID indexed
+# so tutoring doesn't scan the library)
 class TronDeck:
     
-    def __init__(self):
-        self.deck = decklist()
-    
+    def __init__(self, rng = None, deck = None):
+        '''
+        rng: random.Random or numpy Generator used for shuffling
+             (defaults to the global random module)
+        deck: Deck to play, defaults to DEFAULT_DECK
+        '''
+        ids = DECK_IDS if deck is None else deck.ids
+        self.rng = random if rng is None else rng
+        
+        # libraries are ring buffers sized to a power of two, so positions
+        # wrap with a bitmask
+        self.mask = (1 << (len(ids) - 1).bit_length()) - 1
+        self.ring = array('B', ids)
+        self.ring.extend([0] * (self.mask + 1 - len(ids)))
+        self.top = 0
+        self.size = len(ids)
+        self._index()
+        
+        # shuffles are done lazily: the top 'fresh' cards are in their final
+        # order, the next 'pending' cards still have to be shuffled, and any
+        # cards after those were put on the bottom since the last shuffle
+        self.fresh = self.size
+        self.pending = 0
+    
+    # rebuilds the ring positions of each card ID
+    def _index(self):
+        self.where = [set() for cid in range(len(CARDS))]
+        for i in range(self.size):
+            pos = (self.top + i) & self.mask
+            self.where[self.ring[pos]].add(pos)
+    
+    # swaps the cards at two ring positions
+    def _swap(self, a, b):
+        ring = self.ring
+        card_a = ring[a]
+        card_b = ring[b]
+        if card_a != card_b:
+            ring[a] = card_b
+            ring[b] = card_a
+            self.where[card_a].discard(a)
+            self.where[card_a].add(b)
+            self.where[card_b].discard(b)
+            self.where[card_b].add(a)
+    
+    # runs the Fisher-Yates shuffle only as deep as the library is read
+    def _randomize(self, depth):
+        rand = self.rng.random
+        while self.fresh < depth and self.pending:
+            pos = self.top + self.fresh
+            self._swap(pos & self.mask, 
+                       (pos + int(rand() * self.pending)) & self.mask)
+            self.fresh += 1
+            self.pending -= 1
+    
+    # removes the top card, whatever the shuffle state
+    def _pop(self):
+        cid = self.ring[self.top]
+        self.where[cid].discard(self.top)
+        self.top = (self.top + 1) & self.mask
+        self.size -= 1
+        if self.fresh:
+            self.fresh -= 1
+        elif self.pending:
+            self.pending -= 1
+        return cid
+    
+    def __len__(self):
+        return self.size
+    
+    # card IDs in the library, from top to bottom
+    def cards(self):
+        return self.look(self.size)
+    
+    # card IDs of the top n cards, without removing them
+    def look(self, n):
+        self._randomize(n)
+        ring = self.ring
+        top = self.top
+        mask = self.mask
+        return [ring[(top + i) & mask] for i in range(min(n, self.size))]
+    
+    # removes the top n cards and returns their IDs
+    def take_top(self, n):
+        self._randomize(n)
+        return [self._pop() for i in range(min(n, self.size))]
+    
+    # puts cards on the bottom, in order
+    def put_bottom(self, cards):
+        for cid in cards:
+            pos = (self.top + self.size) & self.mask
+            self.ring[pos] = cid
+            self.where[cid].add(pos)
+            self.size += 1
+    
+    # removes a copy of a card from anywhere in the library
+    # (the top card takes its place, so shuffle afterwards)
+    def tutor(self, cid):
+        if self.ring[self.top] != cid:
+            self._swap(self.top, next(iter(self.where[cid])))
+        return self._pop()
+    
+    # a single Fisher-Yates pass, carried out lazily as cards are read
     def shuffle(self):
-        for i in range(0,5):
-            random.shuffle(self.deck)
+        self.fresh = 0
+        self.pending = self.size
     
     # draw opening hand
     def draw_opener(self, handsize):
         self.shuffle()
-        hand = self.deck[:handsize]
-        del self.deck[:handsize]
+        hand = Zone(self.take_top(handsize))
         return hand
     
     def draw(self, hand):
-        hand.append(self.deck[0])
-        self.deck.pop(0)
+        hand.add(self.take_top(1)[0])
     
     def scry_bottom(self):
-        self.deck.append(self.deck[0])
-        del self.deck[0]
+        self.put_bottom(self.take_top(1))
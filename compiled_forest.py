@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Random Forest models compiled to flat arrays
+
+compile_forest copies the nodes of every tree of a trained sklearn
+RandomForestRegressor into one set of arrays (split feature, threshold,
+children and leaf value per node). Evaluating it only needs numpy: all rows
+walk all trees at once, one tree level per step, and the leaf values are
+added up tree by tree in the same order as sklearn, so the predictions are
+exactly the same as model.predict.
+"""
+import numpy as np
+
+# default file for the compiled version of london.MODEL_FILE
+FOREST_FILE = 'ouat_scrying.forest.npz'
+
+
+class CompiledForest:
+    '''
+    feature, threshold, left, right, value -- per node arrays, a row goes
+            left when X[feature] <= threshold, leaves point to themselves
+    roots -- (array) first node of each tree
+    depth -- (int) number of splits on the longest path of any tree
+    source -- (str) SHA-256 of the model file the forest was compiled from,
+              empty if unknown
+    '''
+
+    def __init__(self, feature, threshold, left, right, value, roots, depth,
+                 source = ''):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.source = str(source)
+
+    def predict(self, X):
+        '''
+        X -- feature matrix (n x number of features)
+
+        returns the predictions, as model.predict(X)
+        '''
+        # sklearn compares float32 features to the thresholds
+        X = np.asarray(X, dtype = np.float32)
+        rows = np.arange(len(X))[:, None]
+
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for level in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # added tree by tree, in the order sklearn adds them
+        leaves = self.value[nodes]
+        total = np.zeros(len(X))
+        for tree in range(len(self.roots)):
+            total += leaves[:, tree]
+        return total / len(self.roots)
+
+    def save(self, path = FOREST_FILE):
+        np.savez_compressed(path, feature = self.feature,
+                            threshold = self.threshold, left = self.left,
+                            right = self.right, value = self.value,
+                            roots = self.roots, depth = self.depth,
+                            source = self.source)
+
+
+def compile_forest(model, source = ''):
+    '''
+    model -- trained RandomForestRegressor (single output)
+    source -- (str) SHA-256 of the file the model was loaded from
+
+    returns a CompiledForest
+    '''
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    depth = 0
+    offset = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left < 0
+
+        roots.append(offset)
+        depth = max(depth, tree.max_depth)
+
+        # leaves send every row back to themselves, so all rows can take
+        # the same number of steps
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(np.where(leaf, np.inf, tree.threshold))
+        left.append(np.where(leaf, nodes, tree.children_left) + offset)
+        right.append(np.where(leaf, nodes, tree.children_right) + offset)
+        value.append(tree.value[:, 0, 0])
+
+        offset += tree.node_count
+
+    return CompiledForest(np.concatenate(feature).astype(np.int16),
+                          np.concatenate(threshold),
+                          np.concatenate(left).astype(np.int32),
+                          np.concatenate(right).astype(np.int32),
+                          np.concatenate(value),
+                          np.array(roots, dtype = np.int32), depth, source)
+
+
+# loads a forest saved by CompiledForest.save (forests saved without a
+# source get an empty one)
+def load_forest(path = FOREST_FILE):
+    data = np.load(path)
+    source = data['source'] if 'source' in data.files else ''
+    return CompiledForest(data['feature'], data['threshold'], data['left'],
+                          data['right'], data['value'], data['roots'],
+                          data['depth'], source)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sweeps card counts of the deck list
+
+Variants of the deck list (a grid of card counts, or every one-card swap
+between flex slots) are compared on a turn-to-Tron statistic with successive
+halving: every variant plays a small number of games, then only the better
+half plays twice as many, and so on. Variants whose confidence interval is
+clearly worse than the best one are dropped as soon as that is the case, so
+most games go to the variants that are still in contention.
+
+Games of each variant are cached with sim_cache when seeded, so a repeated
+or extended sweep only plays the games it hasn't played yet.
+"""
+from collections import namedtuple
+from itertools import product
+from math import ceil, sqrt
+import multiprocessing
+from statistics import NormalDist
+import numpy as np
+
+import card_classes
+from adaptive import Estimate
+from parallel import sub_seed
+from sim_cache import run_cached
+from vancouver import sim_deck_turns, TURN_STATISTICS
+
+# cards usually tuned by hand
+FLEX_CARDS = ['Forest', 'Chromatic Star', 'Chromatic Sphere',
+              'Relic of Progenitus', 'Sylvan Scrying', 'Once Upon a Time']
+
+# statistics where a lower value is better (the others are maximized)
+MINIMIZE = ('mean',)
+
+# a variant's deck list, its estimate and the round it was last played in
+SweepResult = namedtuple('SweepResult', ['decklist', 'estimate', 'rounds'])
+
+
+def grid(base, ranges, size = None):
+    '''
+    base -- {card name: copies}, the deck list the variants start from
+    ranges -- {card name: iterable of copies} for the cards to vary
+    size -- (int) only keep variants of this many cards, None for any size
+
+    returns every combination of the counts as a list of deck lists
+    '''
+    names = list(ranges)
+    variants = []
+    for counts in product(*(ranges[name] for name in names)):
+        decklist = dict(base)
+        decklist.update(zip(names, counts))
+        decklist = {name: k for name, k in decklist.items() if k}
+        if size is None or sum(decklist.values()) == size:
+            variants.append(decklist)
+    return variants
+
+
+def swaps(base, cards = FLEX_CARDS):
+    '''
+    base -- {card name: copies}
+    cards -- card names that can be swapped for each other
+
+    returns the base deck list and every list with one copy of one of the
+    cards replaced by another of them, keeping the deck size
+    '''
+    variants = [dict(base)]
+    for out, new in product(cards, cards):
+        if out == new or not base.get(out):
+            continue
+        decklist = dict(base)
+        decklist[out] -= 1
+        decklist[new] = decklist.get(new, 0) + 1
+        variants.append({name: k for name, k in decklist.items() if k})
+    return variants
+
+
+# cards added and removed compared to base, e.g. '+1 Forest -1 Chromatic Star'
+def describe(decklist, base):
+    changes = []
+    for name in sorted(set(decklist) | set(base)):
+        delta = decklist.get(name, 0) - base.get(name, 0)
+        if delta:
+            changes.append('{0:+d} {1}'.format(delta, name))
+    return ' '.join(changes) if changes else 'base list'
+
+
+# turns to Tron in the games a variant hasn't played yet: games have to
+# total of its seeded job, or total - have fresh games without a seed
+def _deck_turns(job):
+    deck, handsize, on_draw, have, total, seed = job
+    if seed is None:
+        return run_cached(sim_deck_turns, total - have,
+                          args = (deck, handsize, on_draw))
+    turns = run_cached(sim_deck_turns, total,
+                       args = (deck, handsize, on_draw), seed = seed,
+                       key = (deck.digest, handsize, int(on_draw)))
+    return turns[have:]
+
+
+def sweep(decklists, statistic = 'mean', handsize = 7, on_draw = False,
+          n = 2000, max_n = 32000, eta = 2, keep = 3, seed = None,
+          workers = 1, confidence = 0.95):
+    '''
+    compares deck lists with successive halving
+    decklists -- list of {card name: copies}, see grid and swaps
+    statistic -- key of vancouver.TURN_STATISTICS: 'mean' (turns to Tron,
+                 lower is better), 'turn3' or 'turn4' (higher is better)
+    n -- (int) games per variant in the first round
+    max_n -- (int) games per variant in the last round
+    eta -- (int) each round keeps 1/eta of the variants and multiplies
+           their games by eta
+    keep -- (int) variants that always survive a round
+    seed -- master seed, all variants play the same seeds
+    workers -- (int) processes playing variants at the same time, None for
+               every core
+
+    returns a SweepResult per variant, best first, with the variants that
+    reached the last round ahead of the ones dropped earlier
+    '''
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    sign = 1 if statistic in MINIMIZE else -1
+    transform = TURN_STATISTICS[statistic]
+    seed = sub_seed(seed, handsize, int(on_draw))
+
+    decks = [card_classes.compile_deck(decklist) for decklist in decklists]
+    values = [np.empty(0) for deck in decks]
+    estimates = [None] * len(decks)
+    rounds = [0] * len(decks)
+    alive = list(range(len(decks)))
+
+    pool = None
+    if workers != 1:
+        pool = multiprocessing.Pool(workers)
+
+    try:
+        total = n
+        round_num = 0
+        while True:
+            round_num += 1
+            jobs = [(decks[i], handsize, on_draw, len(values[i]), total, seed)
+                    for i in alive]
+            new = pool.map(_deck_turns, jobs) if pool else \
+                map(_deck_turns, jobs)
+
+            for i, turns in zip(alive, new):
+                values[i] = np.concatenate([values[i],
+                                            transform(np.asarray(turns))])
+                error = z * np.std(values[i], ddof = 1) / sqrt(len(values[i]))
+                estimates[i] = Estimate(float(np.mean(values[i])),
+                                        float(error), len(values[i]))
+                rounds[i] = round_num
+
+            alive.sort(key = lambda i: sign * estimates[i].mean)
+            if total >= max_n:
+                break
+
+            # drop variants whose interval is entirely worse than the best's,
+            # then keep the best 1/eta of the rest
+            best = estimates[alive[0]]
+            alive = [i for i in alive if sign * (estimates[i].mean -
+                     best.mean) <= estimates[i].half_width + best.half_width]
+            alive = alive[:max(keep, ceil(len(alive) / eta))]
+            total = min(total * eta, max_n)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    order = sorted(range(len(decks)),
+                   key = lambda i: (-rounds[i], sign * estimates[i].mean))
+    return [SweepResult(decklists[i], estimates[i], rounds[i])
+            for i in order]
+
+
+# prints the best variants of a sweep
+def report(results, base, top = 10):
+    for result in results[:top]:
+        est = result.estimate
+        print('{0:.3f} +/- {1:.3f} ({2} games): {3}'.format(
+                est.mean, est.half_width, est.n,
+                describe(result.decklist, base)))
+
+
+def main():
+    base = card_classes.read_decklist()
+    # seeded so repeated runs are read from the simulation cache
+    results = sweep(swaps(base), statistic = 'turn3', seed = 0,
+                    workers = None)
+    report(results, base)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Encodes hands as model features
+
+Each hand becomes one row of an int8 matrix with the columns in
+FEATURE_COLUMNS. This is the order the Random Forest model is trained on,
+so training and prediction always agree on what each column means.
+"""
+import numpy as np
+
+from card_classes import CARD_IDS, CARD_NAMES
+from card_classes import TOWER, MINE, PPLANT, FOREST, GQ, SANCTUM, EMAP, \
+    SCRYING, STIRRINGS, OUAT, STAR, SPHERE, RELIC
+
+NUM_CARDS = len(CARD_NAMES)
+
+# only considers cards relevant to assembling Tron as features
+RELEVANT_CARDS = ['Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant',
+                  'Forest', 'Ghost Quarter', 'Sanctum of Ugin',
+                  'Chromatic Star', 'Chromatic Sphere',
+                  'Relic of Progenitus', 'Ancient Stirrings',
+                  'Sylvan Scrying', 'Expedition Map', 'Once Upon a Time']
+
+# card counts used directly as features
+COUNT_FEATURES = [STIRRINGS, EMAP, FOREST, OUAT, RELIC, SCRYING,
+                  MINE, PPLANT, TOWER]
+
+# column order of the feature matrix:
+#   Ancient Stirrings ... Urza's Tower -- copies of the card in hand
+#   handsize -- number of cards in hand
+#   play_draw -- 1 on the draw, 0 on the play
+#   Chromatic Total -- Chromatic Star + Chromatic Sphere
+#   Other Lands -- Ghost Quarter + Sanctum of Ugin
+#   tron_count -- number of different Tron lands
+#   tron_map_count -- tron_count, plus 1 with an Expedition Map
+#   total_lands -- Tron lands + Other Lands (Forest isn't counted)
+FEATURE_COLUMNS = [CARD_NAMES[cid] for cid in COUNT_FEATURES] + \
+    ['handsize', 'play_draw', 'Chromatic Total', 'Other Lands',
+     'tron_count', 'tron_map_count', 'total_lands']
+
+TRON = [TOWER, MINE, PPLANT]
+
+
+# converts hands (lists of card names) to card counts (n x NUM_CARDS)
+def hand_counts(hands):
+
+    rows = [i for i, hand in enumerate(hands) for card in hand]
+    cids = [CARD_IDS[card] for hand in hands for card in hand]
+
+    counts = np.zeros((len(hands), NUM_CARDS), dtype = np.int8)
+    np.add.at(counts, (rows, cids), 1)
+    return counts
+
+
+def encode_counts(counts, on_draw):
+    '''
+    counts -- card counts of each hand (n x NUM_CARDS)
+    on_draw -- (boolean or array of booleans)
+
+    returns the feature matrix (n x len(FEATURE_COLUMNS), int8)
+    '''
+    X = np.empty((len(counts), len(FEATURE_COLUMNS)), dtype = np.int8)
+    num_counts = len(COUNT_FEATURES)
+
+    X[:, :num_counts] = counts[:, COUNT_FEATURES]
+    X[:, num_counts] = counts.sum(axis = 1)
+    X[:, num_counts + 1] = on_draw
+    X[:, num_counts + 2] = counts[:, STAR] + counts[:, SPHERE]
+    X[:, num_counts + 3] = counts[:, GQ] + counts[:, SANCTUM]
+
+    tron_count = (counts[:, TRON] > 0).sum(axis = 1)
+    X[:, num_counts + 4] = tron_count
+    X[:, num_counts + 5] = tron_count + (counts[:, EMAP] > 0)
+    X[:, num_counts + 6] = counts[:, TRON].sum(axis = 1) + X[:, num_counts + 3]
+
+    return X
+
+# feature matrix for hands given as lists of card names
+def encode_hands(hands, on_draw):
+    return encode_counts(hand_counts(hands), on_draw)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service for evaluating London mulligan hands
+
+Keeps the compiled model and the percentile index in memory and answers
+POST /best_hands with london.best_hand for a batch of openers:
+
+    {"openers": [[7 card names], ...], "handsize": 6, "on_draw": true}
+
+Requests arriving at the same time are micro-batched: the first request
+waits up to MAX_WAIT seconds for others with the same handsize and
+play/draw, and all their openers are scored with a single model call.
+
+request_best_hands is a client for the service and benchmark measures its
+throughput with several concurrent clients.
+"""
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import random
+import threading
+import time
+from urllib import request
+
+import card_classes
+from card_classes import TronDeck
+import london
+
+HOST = '127.0.0.1'
+PORT = 8765
+# seconds a batch stays open for more requests
+MAX_WAIT = 0.002
+# openers scored by one model call at most
+MAX_BATCH = 1024
+
+DECK_NAMES = set(card_classes.CARD_NAMES[cid] for cid in card_classes.DECK_IDS)
+
+
+# openers of one request, filled in with their best hands once scored
+class _Job:
+
+    def __init__(self, openers, handsize, on_draw):
+        self.openers = openers
+        self.key = (handsize, bool(on_draw))
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    '''
+    scores the openers of concurrent requests together on a worker thread
+    model: model used by london.best_hands
+    max_wait: seconds a batch stays open for more requests
+    max_batch: openers scored by one model call at most
+    '''
+
+    def __init__(self, model, max_wait = MAX_WAIT, max_batch = MAX_BATCH):
+        self.model = model
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        threading.Thread(target = self._run, daemon = True).start()
+
+    # best hands of the openers (as london.best_hands), blocks until scored
+    def submit(self, openers, handsize, on_draw):
+        job = _Job(openers, handsize, on_draw)
+        self.queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.results
+
+    def _run(self):
+        while True:
+            jobs = [self.queue.get()]
+            size = len(jobs[0].openers)
+            deadline = time.monotonic() + self.max_wait
+
+            # collect the requests that arrive before the deadline
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self.queue.get(timeout = timeout)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                size += len(job.openers)
+
+            groups = defaultdict(list)
+            for job in jobs:
+                groups[job.key].append(job)
+            for (handsize, on_draw), group in groups.items():
+                self._score(group, handsize, on_draw)
+
+    # scores the openers of jobs with the same handsize and play/draw; if
+    # the combined call fails, each job is scored on its own so one bad
+    # request can't fail the others
+    def _score(self, jobs, handsize, on_draw):
+        try:
+            openers = [opener for job in jobs for opener in job.openers]
+            results = london.best_hands(openers, handsize, on_draw,
+                                        self.model)
+            self.batches += 1
+            start = 0
+            for job in jobs:
+                job.results = results[start:start + len(job.openers)]
+                start += len(job.openers)
+        except Exception as error:
+            if len(jobs) == 1:
+                jobs[0].error = error
+            else:
+                for job in jobs:
+                    self._score([job], handsize, on_draw)
+                return
+        for job in jobs:
+            job.done.set()
+
+
+# checks a request body, returns (openers, handsize, on_draw)
+def parse_request(body):
+
+    openers = body.get('openers')
+    handsize = body.get('handsize')
+    on_draw = body.get('on_draw')
+
+    if not isinstance(openers, list) or not openers:
+        raise ValueError('openers must be a non-empty list of hands')
+    for opener in openers:
+        if not isinstance(opener, list) or len(opener) != 7:
+            raise ValueError('each opener must contain 7 cards')
+        if not all(isinstance(card, str) for card in opener):
+            raise ValueError('card names must be strings')
+        invalid = set(opener) - DECK_NAMES
+        if invalid:
+            raise ValueError('invalid card names: {0}'.format(
+                    sorted(invalid, key = str)))
+    if type(handsize) is not int or handsize not in range(3, 8):
+        raise ValueError('handsize must be an integer from 3 to 7')
+    if not isinstance(on_draw, bool):
+        raise ValueError('on_draw must be true or false')
+
+    return openers, handsize, on_draw
+
+
+class HandHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        if self.path != '/best_hands':
+            self._reply(404, {'error': 'unknown path'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            openers, handsize, on_draw = parse_request(body)
+        except (ValueError, AttributeError) as error:
+            self._reply(400, {'error': str(error)})
+            return
+
+        try:
+            best = self.server.batcher.submit(openers, handsize, on_draw)
+        except Exception as error:
+            self._reply(500, {'error': 'scoring failed: {0}'.format(error)})
+            return
+
+        # compared to the hands of the next mulligan, as in london.main
+        percentiles = self.server.percentiles
+        results = []
+        for cards, turns in best:
+            result = {'keep': list(cards), 'turns': float(turns),
+                      'percentile': None}
+            if percentiles is not None \
+            and (handsize - 1, int(on_draw)) in percentiles.preds:
+                result['percentile'] = int(percentiles.percentile(
+                        float(turns), handsize - 1, on_draw))
+            results.append(result)
+
+        self._reply(200, {'results': results})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # requests aren't logged
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host = HOST, port = PORT, max_wait = MAX_WAIT,
+                max_batch = MAX_BATCH):
+    '''
+    HTTP server with the model and percentile index loaded
+    port: 0 picks a free port (see server.server_address)
+    max_wait, max_batch: as in MicroBatcher
+
+    returns the server, call serve_forever() to start it
+    '''
+    server = ThreadingHTTPServer((host, port), HandHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(london.get_model(), max_wait, max_batch)
+
+    # percentiles are only reported once the simulated hands exist
+    server.percentiles = None
+    if os.path.exists(london.PERCENTILE_FILE) \
+    or os.path.exists(london.SIMS_DIR) or os.path.exists(london.SIMS_FILE):
+        server.percentiles = london.get_percentiles()
+
+    return server
+
+
+def request_best_hands(openers, handsize, on_draw,
+                       url = 'http://{0}:{1}'.format(HOST, PORT)):
+    '''
+    client for the service
+    openers: list of 7 card openers (lists of card names)
+
+    returns a list with a dictionary per opener (keep, turns, percentile)
+    '''
+    body = json.dumps({'openers': openers, 'handsize': handsize,
+                       'on_draw': on_draw}).encode()
+    req = request.Request(url + '/best_hands', data = body,
+                          headers = {'Content-Type': 'application/json'})
+    with request.urlopen(req) as response:
+        return json.loads(response.read())['results']
+
+
+def benchmark(clients = 8, requests = 50, batch = 4, max_wait = MAX_WAIT,
+              seed = 0):
+    '''
+    throughput of a local server with concurrent clients
+    clients: number of client threads
+    requests: requests sent by each client
+    batch: openers per request
+    max_wait: as in MicroBatcher, 0 scores each request on its own
+
+    returns (openers per second, model calls per request)
+    '''
+    rng = random.Random(seed)
+    openers = [[card.name for card in TronDeck(rng).draw_opener(7)]
+               for i in range(clients * requests * batch)]
+
+    server = make_server(port = 0, max_wait = max_wait)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    url = 'http://{0}:{1}'.format(*server.server_address)
+
+    def client(i):
+        for j in range(requests):
+            start = (i * requests + j) * batch
+            request_best_hands(openers[start:start + batch], 6, True, url)
+
+    threads = [threading.Thread(target = client, args = (i,))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    server.server_close()
+
+    return (len(openers) / elapsed,
+            server.batcher.batches / (clients * requests))
+
+
+def main():
+    server = make_server()
+    print('serving on http://{0}:{1}'.format(*server.server_address))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the game simulation
+
+A Profiler counts and times every action of the games played while it is
+enabled: land plays, casts, abilities, tutors, draws, the opening hand,
+shuffles of the library and the lazy randomization steps that carry them
+out as cards are read, grouped by game and turn. It works by swapping
+timing wrappers into vancouver and card_classes while enabled and putting
+the original functions back afterwards, so the simulation runs its normal
+code, with no overhead at all, when no Profiler is enabled.
+
+Only games played in this process are seen, so profile with workers = 1.
+
+    with Profiler() as prof:
+        vancouver.sim_game_turns(7, False, 1000)
+    prof.report()
+    prof.write_collapsed('sim.folded')   # input for flamegraph.pl
+"""
+from collections import defaultdict
+from time import perf_counter_ns
+
+import card_classes
+import vancouver
+
+# methods of the card classes, by the action they are reported as
+CARD_ACTIONS = {'play': 'play', 'cast': 'cast', 'ability': 'ability'}
+
+# library methods and the actions they are reported as (shuffle only marks
+# the library as unshuffled, _randomize carries the shuffle out lazily on
+# every draw, look and take_top)
+DECK_ACTIONS = {'draw': 'draw', 'draw_opener': 'opener',
+                'shuffle': 'shuffle', '_randomize': 'randomize'}
+
+
+class Profiler:
+    '''
+    times the actions of simulated games, grouped by their call stacks
+    (game, turn, action, nested actions)
+    '''
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.self_ns = defaultdict(int)
+        self.total_ns = defaultdict(int)
+        self._stack = []
+        self._child_ns = [0]
+        self._patched = []
+
+    # wraps func so each call is timed as the frame name(*args)
+    def _wrap(self, func, name):
+        stack = self._stack
+        child_ns = self._child_ns
+
+        def timed(*args, **kwargs):
+            stack.append(name(*args))
+            child_ns.append(0)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter_ns() - start
+                key = tuple(stack)
+                inner = child_ns.pop()
+                self.calls[key] += 1
+                self.self_ns[key] += elapsed - inner
+                self.total_ns[key] += elapsed
+                child_ns[-1] += elapsed
+                stack.pop()
+
+        timed.__wrapped__ = func
+        return timed
+
+    def _patch(self, owner, attr, name):
+        func = owner.__dict__[attr]
+        self._patched.append((owner, attr, func))
+        setattr(owner, attr, self._wrap(func, name))
+
+    def enable(self):
+        if self._patched:
+            return
+
+        self._patch(vancouver, 'sim_magic', lambda *args: 'game')
+        self._patch(vancouver, 'sim_turn',
+                    lambda hand, deck, bfield, turn:
+                        'turn {0}'.format(turn + 1))
+        self._patch(card_classes, 'tron_tutor', lambda *args: 'tutor')
+
+        # each class defining one of the card methods is patched once
+        targets = set((klass, attr) for card in card_classes.CARDS
+                      for klass in type(card).__mro__
+                      for attr in CARD_ACTIONS if attr in klass.__dict__)
+        for klass, attr in targets:
+            self._patch(klass, attr,
+                        lambda card, *args, action = CARD_ACTIONS[attr]:
+                            '{0} {1}'.format(action, card.name))
+
+        for attr, action in DECK_ACTIONS.items():
+            self._patch(card_classes.TronDeck, attr,
+                        lambda *args, action = action: action)
+
+    # puts the original functions back
+    def disable(self):
+        while self._patched:
+            owner, attr, func = self._patched.pop()
+            setattr(owner, attr, func)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    # number of games and turns played while enabled
+    def num_games(self):
+        return self.calls.get(('game',), 0)
+
+    def num_turns(self):
+        return sum(calls for key, calls in self.calls.items()
+                   if len(key) == 2 and key[1].startswith('turn '))
+
+    def summary(self, by = 'action'):
+        '''
+        by -- 'action' (play, cast, draw, ...), 'card' (cast Ancient
+              Stirrings, ...) or 'turn' (everything done in turn 1, turn 2,
+              ...), the 'game' and 'turn' actions are the time spent in
+              sim_magic and sim_turn themselves
+
+        returns {name: (calls, self time in seconds)}, largest time first,
+        self time leaves out the time spent in nested actions
+        '''
+        totals = defaultdict(lambda: [0, 0])
+        for key, calls in self.calls.items():
+            frame = key[-1]
+            if by == 'turn':
+                if len(key) < 2 or not key[1].startswith('turn'):
+                    continue
+                name = key[1]
+            elif by == 'card' and not frame.startswith('turn '):
+                name = frame
+            else:
+                name = frame.split(' ')[0]
+            totals[name][0] += calls
+            totals[name][1] += self.self_ns[key]
+
+        return {name: (calls, ns / 1e9) for name, (calls, ns) in
+                sorted(totals.items(), key = lambda item: -item[1][1])}
+
+    # prints the summary with the calls and time per game
+    def report(self, by = 'action'):
+        games = max(self.num_games(), 1)
+        print('{0} games, {1:.2f} turns per game'.format(
+                self.num_games(), self.num_turns() / games))
+        print('{0:<40} {1:>12} {2:>12} {3:>10}'.format(
+                by, 'calls/game', 'us/game', 'us/call'))
+        for name, (calls, seconds) in self.summary(by).items():
+            print('{0:<40} {1:>12.2f} {2:>12.1f} {3:>10.2f}'.format(
+                    name, calls / games, seconds * 1e6 / games,
+                    seconds * 1e6 / calls))
+
+    # self time per call stack in microseconds, in the collapsed stack format
+    # read by flamegraph.pl and speedscope
+    def collapsed(self):
+        return ['{0} {1}'.format(';'.join(key), ns // 1000)
+                for key, ns in sorted(self.self_ns.items())]
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as file:
+            file.write('\n'.join(self.collapsed()) + '\n')
+
+
+def main():
+    with Profiler() as prof:
+        vancouver.sim_game_turns(7, False, 2000)
+    prof.report()
+    prof.report('turn')
+    prof.write_collapsed('sim.folded')
+
+
+if __name__ == '__main__':
+    main()
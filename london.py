@@ -5,44 +5,246 @@ Simulate hands with the London mulligan rule
 Predicts expected turns to achieve Tron using a Random Forest model rather 
 than direct simulations
 
+The model's predictions are precomputed for every opener composition with
+build_lookup, so evaluating a hand is a table lookup (build the table
+ahead of time with `python london.py build`). The model itself is used in
+its compiled form (compiled_forest), which doesn't need sklearn
+
 version 2.0: updated for Once Upon a Time
 """
+from collections import Counter
+import hashlib
 from itertools import combinations 
+import os
+import sys
 import numpy as np
-import pandas as pd
-import pickle
 
 import card_classes
 from card_classes import TronDeck
 
-import model_turns as mtv
+import compiled_forest
+import features
+from features import RELEVANT_CARDS
+from mulligan_sim import hand_compositions
+from parallel import sub_seed
+from results_store import ResultsStore, write_results
+from sim_cache import run_cached
+
+# this model is trained on hands that don't scry on mulligans
+MODEL_FILE = 'ouat_scrying.model'
+# best hands predicted by the model for every opener, see build_lookup
+LOOKUP_FILE = 'london_lookup.npz'
+# predicted turns of the best hands from simulated openers, see 
+# create_sims_table (SIMS_FILE is the optional csv copy)
+SIMS_DIR = 'london_sims'
+SIMS_FILE = 'london_sims_RandomForest.csv'
+# the same predictions sorted by handsize and play/draw, see 
+# build_percentiles
+PERCENTILE_FILE = 'london_percentiles.npz'
+
+# SHA-256 of a file's contents
+def file_digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+# size and modification time of a file, a cheap check that it hasn't been
+# replaced (None if there is no such file)
+def file_stamp(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return '{0}:{1}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+# predicts turns to achieve Tron for a list of hands
+def predict_turns(hands, on_draw, model):
+    return model.predict(features.encode_hands(hands, on_draw))
 
  # predicts the best possible hand from 7 cards and expected Tron turn
 def best_hand(handnames, handsize, on_draw, model):
+    return best_hands([handnames], handsize, on_draw, model)[0]
+
+
+# best_hand for many openers, with a single model call for all of them
+def best_hands(openers, handsize, on_draw, model):
+    
+    # duplicate cards give identical sub-hands, so only score each once
+    all_combs = []
+    for handnames in openers:
+        unique = {}
+        for comb in combinations(handnames, handsize):
+            unique.setdefault(tuple(sorted(comb)), comb)
+        all_combs.append(list(unique.values()))
+    
+    turn_pred = predict_turns([comb for combs in all_combs for comb in combs],
+                              on_draw, model)
+    
+    output = []
+    start = 0
+    for combs in all_combs:
+        preds = turn_pred[start:start + len(combs)]
+        start += len(combs)
+        output.append((combs[preds.argmin()], round(min(preds), 2)))
+    
+    return output
+
+
+# the model only sees the cards in features.RELEVANT_CARDS, so hands are 
+# grouped by their counts of those cards (plus a count of all other cards)
+def hand_key(handnames):
+    counts = Counter(handnames)
+    key = [counts[card] for card in RELEVANT_CARDS]
+    key.append(len(handnames) - sum(key))
+    return tuple(key)
+
+# a hand with the given key, using Karn Liberated for all other cards
+def key_names(key):
+    names = [card for card, k in zip(RELEVANT_CARDS, key) 
+             for i in range(k)]
+    return names + ['Karn Liberated'] * key[-1]
+
+# keys of every hand of handsize cards that can be drawn from the deck
+def deck_keys(handsize):
+    counts = hand_key([card_classes.CARD_NAMES[cid] 
+                       for cid in card_classes.DECK_IDS])
+    return list(hand_compositions(counts, handsize))
+
+
+def build_lookup(model, path = LOOKUP_FILE, source = ''):
+    '''
+    predicts the best hand and its expected Tron turn for every 7 card opener,
+    handsize and play/draw, and saves them as a lookup table
+    model: compiled model used by best_hand
+    path: output file (.npz)
+    source: file_stamp of the model file, saved with the table
+    '''
+    openers = deck_keys(7)
+    handsizes = range(7, 2, -1)
+    keeps = np.zeros((len(openers), 2, len(handsizes)), dtype = np.uint16)
+    turns = np.zeros((len(openers), 2, len(handsizes)), dtype = np.float32)
+    sub_keys = {}
     
-    combs = list(combinations(handnames, handsize))
+    for i, handsize in enumerate(handsizes):
+        sub_keys[handsize] = deck_keys(handsize)
+        index = {key: j for j, key in enumerate(sub_keys[handsize])}
+        hands = [key_names(key) for key in sub_keys[handsize]]
+        
+        for on_draw in (0, 1):
+            # every opener's hands are among the hands drawn from the deck,
+            # so each hand only needs to be predicted once
+            turn_pred = predict_turns(hands, on_draw, model)
+            
+            for row, opener in enumerate(openers):
+                sub_hands = [index[key] for key in 
+                             hand_compositions(opener, handsize)]
+                best = sub_hands[turn_pred[sub_hands].argmin()]
+                keeps[row, on_draw, i] = best
+                turns[row, on_draw, i] = round(turn_pred[best], 2)
     
-    # 0 is a placeholder for output (turns)
-    inputs = [(sub_hand, 0) for sub_hand in combs]
+    np.savez_compressed(path, openers = np.array(openers, dtype = np.int8),
+                        keeps = keeps, turns = turns, source = source,
+                        **{'hands_{0}'.format(handsize): 
+                           np.array(keys, dtype = np.int8)
+                           for handsize, keys in sub_keys.items()})
+
+
+# best hands and expected Tron turns from build_lookup
+class LondonLookup:
     
-    df_hands = mtv.assemble_table(inputs)
-    df_hands['play_draw'] = [int(on_draw)] * len(inputs)    
-    df_hands = mtv.new_features(df_hands)
+    def __init__(self, path = LOOKUP_FILE):
+        self.digest = file_digest(path)
+        data = np.load(path)
+        # file_stamp of the model file the table was built from (empty if
+        # unknown)
+        self.source = str(data['source']) if 'source' in data.files else ''
+        self.rows = {tuple(key): row 
+                     for row, key in enumerate(data['openers'].tolist())}
+        self.keeps = data['keeps']
+        self.turns = data['turns']
+        self.hands = {handsize: data['hands_{0}'.format(handsize)].tolist()
+                      for handsize in range(7, 2, -1)}
     
-    X = df_hands.drop('turns', axis = 1).iloc[:, :(df_hands.shape[1]+1)].values
-    turn_pred = model.predict(X)
+    # same output as best_hand, without running the model for openers that
+    # can be drawn from the deck (others, e.g. with more Forests than the
+    # deck has, are passed to the model)
+    def best_hand(self, handnames, handsize, on_draw):
+        
+        row = self.rows.get(hand_key(handnames))
+        if row is None:
+            return best_hand(handnames, handsize, on_draw, get_model())
+        keep = list(self.hands[handsize][self.keeps[row, int(on_draw), 
+                                                    7-handsize]])
+        best_turn = round(float(self.turns[row, int(on_draw), 7-handsize]), 2)
+        
+        # pick the kept cards from the opener in their original order
+        slots = {card: i for i, card in enumerate(RELEVANT_CARDS)}
+        best_cards = []
+        for name in handnames:
+            i = slots.get(name, len(keep) - 1)
+            if keep[i]:
+                keep[i] -= 1
+                best_cards.append(name)
+        
+        return (tuple(best_cards), best_turn)
 
-    best_cards = combs[turn_pred.argmin()]
-    best_turn = round(min(turn_pred), 2)
+
+# loads the compiled model, (re)compiling MODEL_FILE if the compiled model
+# doesn't exist yet or was compiled from a different MODEL_FILE
+def open_model(path = compiled_forest.FOREST_FILE):
+    
+    source = file_digest(MODEL_FILE) if os.path.exists(MODEL_FILE) else None
+    if os.path.exists(path):
+        forest = compiled_forest.load_forest(path)
+        if source is None or forest.source == source:
+            return forest
     
-    return (best_cards, best_turn)
+    # only needed once per model, unpickling the model imports sklearn
+    import pickle
+    with open(MODEL_FILE, 'rb') as file:
+        # this model is trained on hands that don't scry on mulligans
+        model = pickle.load(file)
+    forest = compiled_forest.compile_forest(model, source)
+    forest.save(path)
+    return forest
+
+
+# loads the lookup table, (re)building it with get_model() if it doesn't
+# exist yet or MODEL_FILE changed since it was built. Only the stamp of
+# MODEL_FILE is checked, so the model isn't loaded when the table is current
+def open_lookup(path = LOOKUP_FILE):
+    
+    source = file_stamp(MODEL_FILE)
+    if os.path.exists(path):
+        lookup = LondonLookup(path)
+        if source is None or lookup.source == source:
+            return lookup
+    
+    print('building the lookup table {0}, this takes a few minutes'.format(
+            path))
+    build_lookup(get_model(), path, source or '')
+    return LondonLookup(path)
+
+
+# models and lookup tables loaded so far in this process, by file
+_loaded = {}
+
+# compiled model, loaded on first use and then shared by the whole process
+def get_model(path = compiled_forest.FOREST_FILE):
+    if ('model', path) not in _loaded:
+        _loaded['model', path] = open_model(path)
+    return _loaded['model', path]
+
+# lookup table, loaded on first use and then shared by the whole process
+def get_lookup(path = LOOKUP_FILE):
+    if ('lookup', path) not in _loaded:
+        _loaded['lookup', path] = open_lookup(path)
+    return _loaded['lookup', path]
 
 
 # estimate average turns to achieve tron using 1000 simulations
 def expected_turns(on_draw):
     
-    # this model is trained on hands that don't scry on mulligans
-    model = pickle.load(open('ouat_scrying.model', 'rb'))
+    lookup = get_lookup()
     avg_turns = []
     all_preds = []
     
@@ -53,7 +255,7 @@ def expected_turns(on_draw):
             library = TronDeck()
             hand = library.draw_opener(7)
             handnames = [card.name for card in hand]
-            pred_turn = best_hand(handnames, handsize, on_draw, model)[1]
+            pred_turn = lookup.best_hand(handnames, handsize, on_draw)[1]
             preds.append(pred_turn)
         avg_output = (handsize, round(np.mean(preds), 2))
         print(avg_output)
@@ -64,40 +266,118 @@ def expected_turns(on_draw):
     #return all_preds    
 
 
+# predicted turns for the best hands from n openers
+def predict_openers(handsize, on_draw, lookup, n, rng = None):
+    
+    output = []
+    
+    for i in range(n):
+        library = TronDeck(rng)
+        hand = library.draw_opener(7)
+        handnames = [card.name for card in hand]
+        pred_turn = lookup.best_hand(handnames, handsize, on_draw)[1]
+        result = (handsize, int(on_draw), round(pred_turn, 2))
+        output.append(result)
+    
+    return output
+
+
 # helper function to run and save simulations
-def sim_london(on_draw):
+def sim_london(on_draw, seed = None, workers = 1):
     
-    # this model is trained on hands that don't scry on mulligans
-    model = pickle.load(open('ouat_scrying.model', 'rb'))
+    lookup = get_lookup()
     output = []
     
     for handsize in range(7, 2, -1):
         print('simulating {0} card hands'.format(handsize))
-        for i in range(5000):
-            library = TronDeck()
-            hand = library.draw_opener(7)
-            handnames = [card.name for card in hand]
-            pred_turn = best_hand(handnames, handsize, on_draw, model)[1]
-            result = (handsize, int(on_draw), round(pred_turn, 2))
-            output.append(result)
+        # cached on disk when seeded
+        preds = run_cached(predict_openers, 5000, 
+                           args = (handsize, on_draw, lookup),
+                           seed = sub_seed(seed, handsize, int(on_draw)),
+                           workers = workers,
+                           key = (handsize, int(on_draw), lookup.digest))
+        output += [(int(size), int(draw), pred) 
+                   for size, draw, pred in preds.tolist()]
     
     return output
 
-# create a table of simulated results
-def create_sims_table():
+# create a table of simulated results, and a csv copy of it if to_csv
+def create_sims_table(seed = None, workers = 1, to_csv = False):
     
-    sims_draw = sim_london(True)
-    sims_play = sim_london(False)
-    sims_tot = sims_draw + sims_play
+    sims_draw = sim_london(True, seed, workers)
+    sims_play = sim_london(False, seed, workers)
+    sims_tot = np.array(sims_draw + sims_play)
     
-    dfs = pd.Dataframe(sims_tot, columns = ['handsize', 'play_draw', 'pred'])
-    dfs.to_csv('london_sims_RandomForest.csv', index = False)
+    columns = {'handsize': sims_tot[:, 0].astype(int),
+               'play_draw': sims_tot[:, 1].astype(int),
+               'pred': sims_tot[:, 2]}
+    write_results(SIMS_DIR, columns, SIMS_FILE if to_csv else None)
+    build_percentiles(sims_tot)
+
+
+def build_percentiles(sims, path = PERCENTILE_FILE):
+    '''
+    sorts the predicted turns by handsize and play/draw and saves them
+    sims: rows of (handsize, play_draw, pred), as in create_sims_table
+    path: output file (.npz)
+    '''
+    sims = np.asarray(sims, dtype = float).reshape(-1, 3)
+    # predictions are rounded to 2 decimals, so they are stored exactly as
+    # hundredths of a turn
+    hundredths = np.round(sims[:, 2] * 100).astype(np.int16)
+    
+    arrays = {}
+    for handsize in np.unique(sims[:, 0]).astype(int):
+        for on_draw in (0, 1):
+            rows = (sims[:, 0] == handsize) & (sims[:, 1] == on_draw)
+            arrays['preds_{0}_{1}'.format(handsize, on_draw)] = \
+                np.sort(hundredths[rows])
+    
+    np.savez(path, **arrays)
+
+
+# sorted predictions from build_percentiles
+class PercentileIndex:
+    
+    def __init__(self, path = PERCENTILE_FILE):
+        data = np.load(path)
+        self.preds = {tuple(int(x) for x in name.split('_')[1:]): data[name] 
+                      for name in data.files}
+    
+    # percentage of simulated handsize card hands predicted to take at least
+    # as many turns as pred_turn
+    def percentile(self, pred_turn, handsize, on_draw):
+        preds = self.preds[handsize, int(on_draw)]
+        worse = len(preds) - np.searchsorted(preds, round(pred_turn * 100))
+        return round(worse / len(preds) * 100)
+
+
+# loads the percentile index, building it from the simulated results if it
+# doesn't exist (SIMS_DIR, or a SIMS_FILE from before SIMS_DIR existed)
+def open_percentiles(path = PERCENTILE_FILE):
+    
+    if not os.path.exists(path):
+        if os.path.exists(SIMS_DIR):
+            table = ResultsStore(SIMS_DIR).select()
+            sims = np.column_stack([table['handsize'], table['play_draw'],
+                                    table['pred']])
+        else:
+            sims = np.loadtxt(SIMS_FILE, delimiter = ',', skiprows = 1)
+        build_percentiles(sims, path)
+    
+    return PercentileIndex(path)
+
+# percentile index, loaded on first use and then shared by the whole process
+def get_percentiles(path = PERCENTILE_FILE):
+    if ('percentiles', path) not in _loaded:
+        _loaded['percentiles', path] = open_percentiles(path)
+    return _loaded['percentiles', path]
 
 # helper function to process a user input hand
 def input_hand():
     
     library = TronDeck()
-    valid_cards = set([card.name for card in library.deck])
+    valid_cards = set([card_classes.CARD_NAMES[cid] for cid in library.cards()])
     
     names = input('Input your 7 cards (Full names, capitalized, separated by ;): ')
     names = names.split(';')
@@ -122,6 +402,12 @@ def input_play_draw():
     else:
         raise ValueError('input must be y/n')
 
+# builds the lookup table ahead of interactive use, if it is missing or out
+# of date (python london.py build)
+def build():
+    get_lookup()
+    print('the lookup table {0} is up to date'.format(LOOKUP_FILE))
+
 # evaluate an input hand and compare it to the next round of mulligans
 def main():
     
@@ -130,15 +416,11 @@ def main():
     num_mull = int(input('How many times did you mulligan (0-4)? '))
     handsize = 7 - num_mull
     
-    model = pickle.load(open('ouat_scrying.model', 'rb'))
-    
-    best = best_hand(handnames, handsize, on_draw, model)
+    lookup = get_lookup()
     
-    df = pd.read_csv('london_sims_RandomForest.csv')
-    df_sub = df[df['play_draw'] == int(on_draw)]
-    df_sub = df_sub[df_sub['handsize'] == handsize-1]
+    best = lookup.best_hand(handnames, handsize, on_draw)
     
-    percentile = round((sum(df_sub['pred'] >= best[1])/len(df_sub['pred']) * 100))
+    percentile = get_percentiles().percentile(best[1], handsize-1, on_draw)
     
     print('Your best {0} card hand is:\n{1}'.format(handsize, best[0]))
     print('It is predicted to achieve Tron on turn', round(best[1], 2))
@@ -146,5 +428,8 @@ def main():
     
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['build']:
+        build()
+    else:
+        main()
             
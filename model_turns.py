@@ -4,10 +4,13 @@
 Train a Random Forest model to predict turns to achieve Tron, using data
 from simulated games
 
+Large training sets are streamed to disk in chunks with write_training_data
+and read back with load_training_data
+
 version 2.0: updated for Once Upon a Time
 """
 
-from collections import Counter
+import os
 import numpy as np
 import pandas as pd
 import pickle
@@ -15,158 +18,172 @@ from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 #import xgboost as xgb
 import vancouver as vc
+import features
+from features import FEATURE_COLUMNS
+from parallel import run_sharded, iter_sharded, sub_seed
+from results_store import write_results
+from sim_cache import run_cached
+
+# directory and chunk size for write_training_data
+DATA_DIR = 'training_data'
+ROWS_PER_FILE = 100000
+# directory of the table saved by save_df
+TABLE_DIR = 'simulated_results'
 
 # simulates n*5 hands and saves to a list
-def sim_hands(n, on_draw):
+def sim_hands(n, on_draw, seed = None, workers = 1):
     '''
     n -- (int) number of simulations per starting handsize
     draw -- (boolean) on the draw
+    seed -- (int) master seed for reproducible runs
+    workers -- (int) number of processes (None for every core)
     '''
 
     output = []
     
     for handsize in range(3,8):
-        for j in range(n):
-            sim = vc.sim_magic(handsize, on_draw)
-            output.append(sim)
+        sims = run_sharded(vc.sim_games, n, args = (handsize, on_draw),
+                           seed = sub_seed(seed, handsize, int(on_draw)),
+                           workers = workers)
+        output.extend(sims)
     
     return output
             
-# formats hand and output turn for dataframe
-def format_hand(hand):
-    
-    # only considers cards relevant to assembling Tron as features
-    relevant_cards = ['Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant',
-                      'Forest', 'Ghost Quarter', 'Sanctum of Ugin',
-                      'Chromatic Star', 'Chromatic Sphere', 
-                      'Relic of Progenitus', 'Ancient Stirrings', 
-                      'Sylvan Scrying', 'Expedition Map', 'Once Upon a Time']
-    
-    counts = Counter(hand[0])
-    
-    # output of model - number of turns to achieve Tron
-    hand_dict = {'handsize':len(hand[0]), 'turns':hand[1]}
+# features and output turns of n simulated games, one row per game
+def sim_features(handsize, on_draw, n, rng = None):
     
-    for card in relevant_cards: 
-        if card in counts.keys():
-            hand_dict[card] = counts[card]
-        else:
-            hand_dict[card] = 0
-            
-    return hand_dict
-            
-# joins simulated hands into a dataframe
-def assemble_table(hands):
-
-    hands_as_dicts = [format_hand(hand) for hand in hands]
-    tron_df = pd.DataFrame(hands_as_dicts)
-    return tron_df
+    games = vc.sim_games(handsize, on_draw, n, rng)
+    X = features.encode_hands([game[0] for game in games], on_draw)
+    return np.column_stack([X, [game[1] for game in games]])
 
-def create_df(n, on_draw):
+def create_df(n, on_draw, seed = None, workers = 1):
     '''
     n -- (int) number of simulations per starting hand
     on_draw -- (boolean)
     '''
-    sim_data = sim_hands(n, on_draw)
-    df_sim = assemble_table(sim_data)
-    df_sim['play_draw'] = [int(on_draw)] * (n*5)
-    
+    # cached on disk when seeded
+    rows = np.concatenate([
+            run_cached(sim_features, n, args = (handsize, on_draw),
+                       seed = sub_seed(seed, handsize, int(on_draw)),
+                       workers = workers)
+            for handsize in range(3,8)])
+    
+    df_sim = pd.DataFrame(rows[:, :-1].astype(np.int8), 
+                          columns = FEATURE_COLUMNS)
+    # output of model - number of turns to achieve Tron
+    df_sim['turns'] = rows[:, -1]
     return df_sim
 
 
-# helper function to count presence of unique cards in hand
-def unique_counts(arr):
+# generate dataframe with features from features.encode_hands
+def prep_df(n, seed = None, workers = 1):
+    # n -- (int) number of simulations per starting hand 
+    print('performing', n*10, 'simulations')
     
-    count = 0
-    for num in arr:
-        if num:
-            count += 1
-        else:
-            continue
+    df_draw = create_df(n, True, seed, workers)
+    df_play = create_df(n, False, seed, workers)
+
+    df = pd.concat([df_draw, df_play], ignore_index = True)
+    
+    # remove outliers
+    df = df[df['turns'] < 16]
     
-    return count
+    return df
 
 
-# count combinations of features as a new feature
-def unique_total(df, cols):
-    '''
-    df -- input dataframe
-    cols -- list of column names
-    '''
-    df_sub = df[cols]
-    new_col = [unique_counts(row) for row in df_sub.itertuples(index = False)]
-    return new_col
+# saves a table from prep_df as columns (see results_store), and as csv
+# too if csv_path is given (e.g. 'simulated_results.csv' for the Shiny app)
+def save_df(df, path = TABLE_DIR, csv_path = None):
+    write_results(path, df, csv_path)
 
 
-def unique_sum(df, cols):
+# streams features and turns of simulated games, one shard at a time
+def stream_games(n, on_draw, seed = None, workers = 1):
     '''
-    df -- input dataframe
-    cols -- list of column names
+    n -- (int) number of simulations per starting handsize
+    on_draw -- (boolean)
+    
+    yields (X, y) arrays of the games in each shard, without outliers
     '''
-    df_sub = df[cols]
-    new_col = [sum(row) for row in df_sub.itertuples(index = False)]
-    return new_col
+    for handsize in range(3,8):
+        shards = iter_sharded(vc.sim_games, n, args = (handsize, on_draw),
+                              seed = sub_seed(seed, handsize, int(on_draw)),
+                              workers = workers)
+        for games in shards:
+            X = features.encode_hands([game[0] for game in games], on_draw)
+            y = np.array([game[1] for game in games], dtype = np.int16)
+            
+            # remove outliers
+            keep = y < 16
+            yield X[keep], y[keep]
 
-def new_features(df):
-    
-    # combine counts for chromatic star and chromatic sphere
-    df['Chromatic Total'] = df['Chromatic Star'] + df['Chromatic Sphere']
-    # combine counts for non-Tron non-Forest lands
-    df['Other Lands'] = df['Ghost Quarter'] + df['Sanctum of Ugin']
-    # drop the original columns
-    df.drop(['Chromatic Star', 'Chromatic Sphere', 
-             'Ghost Quarter', 'Sanctum of Ugin'], 
-            axis = 1, inplace = True)
-   
-    # number of unique Tron lands as a feature  
-    df['tron_count'] = unique_total(
-            df,
-            [ "Urza's Mine", 
-             "Urza's Power Plant", 
-             "Urza's Tower"])
-    # unique Tron lands + Map as a feature
-    df['tron_map_count'] = unique_total(
-            df, 
-            ['Expedition Map', 
-             "Urza's Mine", 
-             "Urza's Power Plant", 
-             "Urza's Tower"])
-    # total number of lands as a feature
-    df['total_lands'] = unique_sum(
-            df, 
-            ["Urza's Mine", 
-             "Urza's Power Plant", 
-             "Urza's Tower", 
-             'Other Lands'])
-    
-    return df
 
-# generate dataframe and engineer features
-def prep_df(n):
-    # n -- (int) number of simulations per starting hand 
-    print('performing', n*10, 'simulations')
-    
-    df_draw = create_df(n, True)
-    df_play = create_df(n, False)
+def write_training_data(n, path = DATA_DIR, seed = None, workers = 1,
+                        rows_per_file = ROWS_PER_FILE):
+    '''
+    simulates games on the draw and on the play, and saves their features
+    and turns in chunks (X_00000.npy, y_00000.npy, ...) with bounded memory
+    n -- (int) number of simulations per starting handsize
+    path -- output directory
+    rows_per_file -- (int) games per chunk
+    '''
+    os.makedirs(path, exist_ok = True)
+    
+    buffer_X = np.empty((rows_per_file, len(FEATURE_COLUMNS)), dtype = np.int8)
+    buffer_y = np.empty(rows_per_file, dtype = np.int16)
+    filled = 0
+    num_files = 0
+    
+    def flush(rows):
+        nonlocal num_files
+        name = '{0:05d}.npy'.format(num_files)
+        np.save(os.path.join(path, 'X_' + name), buffer_X[:rows])
+        np.save(os.path.join(path, 'y_' + name), buffer_y[:rows])
+        num_files += 1
+    
+    for on_draw in (True, False):
+        for X, y in stream_games(n, on_draw, seed, workers):
+            start = 0
+            while start < len(y):
+                take = min(rows_per_file - filled, len(y) - start)
+                buffer_X[filled:filled + take] = X[start:start + take]
+                buffer_y[filled:filled + take] = y[start:start + take]
+                filled += take
+                start += take
+                if filled == rows_per_file:
+                    flush(filled)
+                    filled = 0
+    
+    if filled:
+        flush(filled)
 
-    df = pd.concat([df_draw, df_play], sort = True)
 
-    print('assembling table...')
+# reads the chunks saved by write_training_data (memory-mapped if mmap)
+def load_training_data(path = DATA_DIR, mmap = False):
     
-    # remove outliers
-    df = df[df['turns'] < 16]
+    mode = 'r' if mmap else None
+    names = sorted(name[2:] for name in os.listdir(path) 
+                   if name.startswith('y_'))
     
-    print('adding features...')
-
-    df = new_features(df)
+    X = [np.load(os.path.join(path, 'X_' + name), mmap_mode = mode) 
+         for name in names]
+    y = [np.load(os.path.join(path, 'y_' + name), mmap_mode = mode) 
+         for name in names]
     
-    return df
+    if mmap:
+        return X, y
+    return np.concatenate(X), np.concatenate(y)
 
 
 def train_random_forest(df):
     
-    y = df.iloc[:, 11].values
-    X = df.drop('turns', axis = 1).iloc[:, :(df.shape[1]+1)].values
+    y = df['turns'].values
+    X = df[FEATURE_COLUMNS].values
+    
+    return fit_random_forest(X, y)
+
+
+def fit_random_forest(X, y):
     
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2, 
                                                     random_state = 0)  
@@ -5,11 +5,20 @@ Simulates mulligans using the Paris and London mulligan rules
 
 Returns the probability of an opening hand with turn 3 Tron
 when willing to mulligan to 3 card hands
+
+Keep probabilities can also be computed exactly: eval_tron_hand only looks at
+a few card names, so every opener is scored once per composition of those
+cards, weighted by its multivariate hypergeometric probability
 """
+from collections import Counter
+from math import comb, prod
+import random
 import numpy as np
 
 import card_classes
-from card_classes import TronDeck
+from card_classes import TronDeck, CARDS, CARD_IDS
+from sim_cache import run_cached
+from adaptive import sequential_estimate, paired_difference
     
 def eval_tron_hand(opener, true_hand_size):
     
@@ -42,17 +51,16 @@ def eval_tron_hand(opener, true_hand_size):
     
     return keep
 
-def paris_method(n):
-    '''
-    n: number of simulations to perform
-    '''
+# keep decisions for n simulations with the Paris mulligan
+def paris_decisions(n, rng = None):
+    
     decisions = []
 
     for i in range(n):
         keep = False
         mull_count = 0
         while mull_count <= 4 and keep == False:
-            library = TronDeck()
+            library = TronDeck(rng)
             start_size = 7 - mull_count
             opener = library.draw_opener(start_size)
             keep = eval_tron_hand(opener, start_size)
@@ -60,10 +68,21 @@ def paris_method(n):
         
         decisions.append(keep)         
     
-    return np.mean(decisions)
+    return decisions
+
+
+def paris_method(n, seed = None, workers = 1):
+    '''
+    n: number of simulations to perform
+    seed: master seed for reproducible runs (cached on disk)
+    workers: number of processes (None for every core)
+    '''
+    return np.mean(run_cached(paris_decisions, n, seed = seed, 
+                              workers = workers))
             
 
-def london_method(n):
+# keep decisions for n simulations with the London mulligan
+def london_decisions(n, rng = None):
     
     decisions = []
 
@@ -71,7 +90,7 @@ def london_method(n):
         keep = False
         mull_count = 0
         while mull_count <= 4 and keep == False:
-            library = TronDeck()
+            library = TronDeck(rng)
             effective_size = 7 - mull_count
             opener = library.draw_opener(7)
             keep = eval_tron_hand(opener, effective_size)
@@ -79,15 +98,150 @@ def london_method(n):
         
         decisions.append(keep)         
     
-    return np.mean(decisions)
+    return decisions
+
+
+def london_method(n, seed = None, workers = 1):
+    return np.mean(run_cached(london_decisions, n, seed = seed, 
+                              workers = workers))
+
+
+def adaptive_method(rule, half_width, seed = None, workers = 1, 
+                    confidence = 0.95):
+    '''
+    simulates until the success rate is within half_width
+    rule: 'paris' or 'london'
+    half_width: target confidence interval half-width
+    
+    returns an adaptive.Estimate
+    '''
+    decisions = paris_decisions if rule == 'paris' else london_decisions
+    return sequential_estimate(decisions, half_width, seed = seed,
+                               workers = workers, confidence = confidence)
+
+
+# whether a trial keeps a hand, shuffling the library for each mulligan with
+# the given seeds
+def first_keep(rule, deck_seeds):
+    
+    for mull_count, deck_seed in enumerate(deck_seeds):
+        library = TronDeck(random.Random(deck_seed))
+        handsize = 7 - mull_count
+        opener = library.draw_opener(handsize if rule == 'paris' else 7)
+        if eval_tron_hand(opener, handsize):
+            return True
+    
+    return False
+
+# (paris, london) keep decisions for n trials that see the same libraries
+def paired_decisions(n, rng = None):
+    
+    if rng is None:
+        rng = random
+    
+    decisions = []
+    
+    for i in range(n):
+        deck_seeds = [rng.getrandbits(64) for mull_count in range(5)]
+        decisions.append((first_keep('paris', deck_seeds), 
+                          first_keep('london', deck_seeds)))
+    
+    return decisions
+
+
+def paired_method(n, seed = None, workers = 1):
+    '''
+    compares both rules on common random numbers: in each trial the Paris
+    and London hands come from the same shuffled libraries, so the
+    difference has a much smaller standard error than independent runs
+    n: number of trials
+    
+    returns an adaptive.Comparison (a: paris, b: london)
+    '''
+    pairs = run_cached(paired_decisions, n, seed = seed, workers = workers)
+    return paired_difference(pairs)
+
+
+# cards that eval_tron_hand tells apart; all other cards are interchangeable
+KEEP_CARDS = ('Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant',
+              'Expedition Map', 'Sylvan Scrying',
+              'Chromatic Star', 'Chromatic Sphere')
+
+# copies of each card in KEEP_CARDS in the decklist, then all other cards,
+# with a representative card for each group
+def keep_card_counts():
+    
+    deck_counts = Counter(card_classes.DECK_IDS)
+    cids = [CARD_IDS[name] for name in KEEP_CARDS]
+    counts = [deck_counts[cid] for cid in cids]
+    
+    others = [cid for cid in deck_counts if cid not in cids]
+    counts.append(sum(deck_counts[cid] for cid in others))
+    cards = [CARDS[cid] for cid in cids + others[:1]]
+    
+    return counts, cards
+
+# every way to draw handsize cards from groups of the given sizes
+def hand_compositions(counts, handsize):
+    
+    if len(counts) == 1:
+        if handsize <= counts[0]:
+            yield (handsize,)
+        return
+    
+    for k in range(min(counts[0], handsize) + 1):
+        for rest in hand_compositions(counts[1:], handsize - k):
+            yield (k,) + rest
+
+def keep_probability(draw_size, true_hand_size):
+    '''
+    exact probability that eval_tron_hand keeps a hand
+    draw_size: number of cards drawn (int)
+    true_hand_size: handsize after the mulligan (int)
+    '''
+    counts, cards = keep_card_counts()
+    
+    kept = 0
+    for comp in hand_compositions(counts, draw_size):
+        opener = [card for card, k in zip(cards, comp) for i in range(k)]
+        if eval_tron_hand(opener, true_hand_size):
+            kept += prod(comb(n, k) for n, k in zip(counts, comp))
+    
+    return kept / comb(sum(counts), draw_size)
+
+def keep_probabilities(rule):
+    '''
+    exact keep probability for each handsize (7 to 3)
+    rule: 'paris' (draw the smaller hand) or 'london' (draw 7 cards)
+    '''
+    probs = {}
+    for handsize in range(7, 2, -1):
+        draw_size = handsize if rule == 'paris' else 7
+        probs[handsize] = keep_probability(draw_size, handsize)
+    
+    return probs
+
+# exact counterpart of paris_method and london_method
+def exact_method(rule):
+    
+    # each mulligan is an independent fresh draw
+    miss = prod(1 - p for p in keep_probabilities(rule).values())
+    return 1 - miss
 
     
 def main():
     sample_size = 10000
-    paris_success_rate = round(paris_method(sample_size), 3)
-    london_success_rate = round(london_method(sample_size), 3)
+    # seeded so repeated runs are read from the simulation cache
+    seed = 0
+    paris_success_rate = round(paris_method(sample_size, seed), 3)
+    london_success_rate = round(london_method(sample_size, seed), 3)
     print('paris success:', paris_success_rate)
     print('london success:', london_success_rate)
+    print('paris success (exact):', round(exact_method('paris'), 3))
+    print('london success (exact):', round(exact_method('london'), 3))
+    paired = paired_method(sample_size, seed)
+    print('london - paris (paired):', round(paired.difference, 3), 
+          '+/-', round(paired.se, 3), 'SE')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs simulation jobs across a process pool
+
+A job of n simulations is split into fixed-size shards. Each shard gets its
+own seed spawned from a master seed, and the shard results are merged back
+in shard order, so the output depends only on the master seed and the shard
+size, never on the number of workers.
+"""
+from collections import deque
+import multiprocessing
+import random
+import numpy as np
+
+SHARD_SIZE = 1000
+
+# task and arguments shared by every shard in a worker process
+_job = None
+
+
+# seeds for each shard, spawned from the master seed
+def shard_seeds(seed, num_shards):
+    children = np.random.SeedSequence(seed).spawn(num_shards)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+# derives an independent master seed for one part of a job
+def sub_seed(seed, *keys):
+    if seed is None:
+        return None
+    return [seed, *keys]
+
+
+# runs one shard with its own random number generator
+def run_shard(task, args, size, seed):
+    return list(task(*args, size, rng = random.Random(seed)))
+
+
+def _init_worker(task, args):
+    global _job
+    _job = (task, args)
+
+
+def _worker_shard(shard):
+    task, args = _job
+    return run_shard(task, args, *shard)
+
+
+def iter_sharded(task, n, args = (), seed = None, workers = 1,
+                 shard_size = SHARD_SIZE, skip = 0):
+    '''
+    same as run_sharded, but yields the results of each shard in shard
+    order as soon as it is done; at most two shards per worker are queued
+    or finished and waiting to be read, so memory stays bounded however
+    slowly the results are consumed
+    skip -- (int) number of leading simulations to leave out, a multiple of
+            shard_size (the remaining shards are the same as in a full run)
+    '''
+    if skip % shard_size:
+        raise ValueError('skip must be a multiple of shard_size')
+    
+    sizes = [min(shard_size, n - start) for start in range(0, n, shard_size)]
+    seeds = shard_seeds(seed, len(sizes))
+    first = skip // shard_size
+    shards = zip(sizes[first:], seeds[first:])
+
+    if workers == 1:
+        for shard in shards:
+            yield run_shard(task, args, *shard)
+    else:
+        window = 2 * (workers or multiprocessing.cpu_count())
+        with multiprocessing.Pool(workers, initializer = _init_worker,
+                                  initargs = (task, args)) as pool:
+            # a new shard is only submitted once the oldest one is read
+            pending = deque()
+            for shard in shards:
+                if len(pending) == window:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(_worker_shard, (shard,)))
+            while pending:
+                yield pending.popleft().get()
+
+
+def run_sharded(task, n, args = (), seed = None, workers = 1,
+                shard_size = SHARD_SIZE):
+    '''
+    task -- function called as task(*args, size, rng = random.Random),
+            returns a list of results (must be importable by the workers)
+    n -- (int) total number of simulations
+    args -- (tuple) leading arguments for task, sent once per worker
+    seed -- (int or list of ints) master seed, None for fresh entropy
+    workers -- (int) number of processes, None for every core,
+               1 runs in this process
+    shard_size -- (int) simulations per shard
+    '''
+    results = iter_sharded(task, n, args, seed, workers, shard_size)
+
+    # merge in shard order
+    return [res for shard in results for res in shard]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Caches simulation results on disk
+
+Results of a sharded job are stored under a hash of everything that
+determines them: the deck list, the source code of the card behaviour and
+the task, the task's arguments and the master seed. The number of
+simulations isn't part of the key, since the first n results of a seeded job
+don't depend on its total size, so a larger job reuses the stored results
+and only simulates the games that are missing.
+"""
+import hashlib
+import importlib
+import inspect
+import os
+import numpy as np
+
+import card_classes
+from parallel import iter_sharded, SHARD_SIZE
+
+CACHE_DIR = 'sim_cache'
+
+# modules whose code decides how games play out
+CODE_MODULES = ('card_classes', 'vancouver', 'features')
+
+
+# hash of the card counts of the default deck list
+def deck_hash():
+    return card_classes.DEFAULT_DECK.digest
+
+# hash of the source code of the card behaviour and the task
+def code_hash(task):
+    digest = hashlib.sha256()
+    for name in CODE_MODULES + (task.__module__,):
+        module = importlib.import_module(name)
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+# file holding the results of a job
+def cache_path(task, key, seed, shard_size, path = CACHE_DIR):
+    parts = [deck_hash(), code_hash(task), task.__module__, task.__name__,
+             repr(key), repr(seed), str(shard_size)]
+    digest = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    return os.path.join(path, digest + '.npy')
+
+
+def run_cached(task, n, args = (), seed = None, workers = 1, key = None,
+               shard_size = SHARD_SIZE, path = CACHE_DIR):
+    '''
+    parallel.run_sharded with the results cached on disk
+    task, n, args, seed, workers, shard_size -- as in parallel.run_sharded,
+            the results of task must convert to a numeric array
+    key -- values that identify args (mulligan rule, play/draw, ...),
+           defaults to args
+    path -- cache directory
+
+    returns the results as an array, jobs without a seed aren't cached
+    '''
+    if key is None:
+        key = args
+
+    if seed is None:
+        shards = iter_sharded(task, n, args, seed, workers, shard_size)
+        return np.array([res for shard in shards for res in shard])
+
+    file = cache_path(task, key, seed, shard_size, path)
+    if os.path.exists(file):
+        cached = np.load(file)
+    else:
+        cached = None
+
+    if cached is not None and len(cached) >= n:
+        return cached[:n]
+
+    # only whole shards can be reused, the rest are simulated
+    done = 0 if cached is None else len(cached) // shard_size * shard_size
+    shards = iter_sharded(task, n, args, seed, workers, shard_size,
+                          skip = done)
+    new = np.array([res for shard in shards for res in shard])
+    results = new if cached is None else np.concatenate([cached[:done], new])
+
+    # write to a temporary file first so an interrupted run can't leave a
+    # partial cache entry
+    os.makedirs(path, exist_ok = True)
+    temp = file + '.{0}.tmp'.format(os.getpid())
+    with open(temp, 'wb') as out:
+        np.save(out, results)
+    os.replace(temp, file)
+
+    return results
@@ -9,38 +9,35 @@ Returns turn on which Tron is achieved
 
 version 2.0: updated for Once Upon a Time
 """
+import random
 import numpy as np
 
 import card_classes
-from card_classes import TronDeck, Chromatic
+from card_classes import TronDeck, Battlefield, Chromatic, tron_check
+from card_classes import CARDS, CMC, GMC, AMC, IS_GREEN_SOURCE
+from card_classes import TOWER, MINE, PPLANT, FOREST, GQ, SANCTUM, EMAP, \
+    SCRYING, STIRRINGS, OUAT, STAR, SPHERE, RELIC, MISSING_TRON
+from parallel import sub_seed
+from sim_cache import run_cached
+from adaptive import sequential_estimate, paired_difference
 
 
-# helper function to count tron lands in play
-def tron_check(zone):
-    
-    card_names = {}
-    for card in zone:
-        card_names[card.name] = card_names.get(card.name, 0) + 1
-    
-    tron_set = set(['Urza\'s Tower', 'Urza\'s Mine', 'Urza\'s Power Plant'])
-    return tron_set.difference(card_names)
-
 # simulates the vancouver mulligan scry rule
 def vancouver_scry(library, hand):
     
-    temp = library.deck[0]
-    names = [card.name for card in hand]
+    temp = library.look(1)[0]
+    in_hand = hand.counts
     
     # determine which Tron lands aren't in the starting hand
     tron_needed = tron_check(hand)
     
-    num_lands = [card.card_type for card in hand].count('land')
-    g_sources = set(['Forest', 'Chromatic Star', 'Chromatic Sphere'])
+    num_lands = hand.num_lands()
+    g_source = in_hand[FOREST] or in_hand[STAR] or in_hand[SPHERE]
     
     # code below doesn't care what to do if you already have Tron in hand
 
     # keep on top if card is a Tron land
-    if temp.name in tron_needed:
+    if temp in tron_needed:
         top = True
         
     # bottom anything that's not a Tron land if hand is a 1-lander
@@ -48,21 +45,21 @@ def vancouver_scry(library, hand):
         top = False
         
     # always top Expedition map if hand can cast and activate it
-    elif temp.name == 'Expedition Map':
+    elif temp == EMAP:
         top = True
         
     # keep Sylvan Scrying if hand can cast it
-    elif temp.name == 'Sylvan Scrying' or temp.name == 'Ancient Stirrings':
-        if len(g_sources.intersection(set(names))) > 0:
+    elif temp == SCRYING or temp == STIRRINGS:
+        if g_source:
             top = True
         
         else:
             top = False
         
     # only keep Star/Sphere if hand contains Scrying/Stirrings but no green source
-    elif temp.name == 'Chromatic Star' or temp.name == 'Chromatic Sphere':
-        if 'Sylvan Scrying' in names or 'Ancient Stirrings' in names \
-        and len(g_sources.intersection(set(names))) == 0:
+    elif temp == STAR or temp == SPHERE:
+        if in_hand[SCRYING] or in_hand[STIRRINGS] \
+        and not g_source:
             top = True
         
         else: 
@@ -75,53 +72,47 @@ def vancouver_scry(library, hand):
     if top is False:
         library.scry_bottom()
     
+# order in which plays are made (Once Upon a Time is only cast for free on
+# the first turn)
+PRIORITY = ((EMAP, 'ability'), (SCRYING, 'cast'), 
+            (EMAP, 'cast'), (STIRRINGS, 'cast'),
+            (STAR, 'ability'), (SPHERE, 'ability'),
+            (STAR, 'cast'), (SPHERE, 'cast'),
+            (RELIC, 'ability'), (RELIC, 'cast'),
+            (FOREST, 'play'), (GQ, 'play'), (SANCTUM, 'play'),
+            (TOWER, 'play'), (MINE, 'play'), (PPLANT, 'play'))
+
 def sim_turn(hand, deck, bfield, turn):
         
-    manapool = [card.card_type for card in bfield].count('land')
-    g_mana = [card.name for card in bfield].count('Forest')
+    in_hand = hand.counts
+    in_play = bfield.counts
+    
+    manapool = bfield.lands
+    g_mana = bfield.green_sources
 
     land_drop = False
     plays = True
     
     # cast Once Upon a Time for free
     if turn == 0:
-        hand_names = [card.name for card in hand]
-        if 'Once Upon a Time' in hand_names:
-            card = hand[hand_names.index('Once Upon a Time')]
-            card.cast(hand, deck, bfield)
+        if in_hand[OUAT]:
+            CARDS[OUAT].cast(hand, deck, bfield)
     
     # continue until no plays are available
     while plays:
         plays = False
         
-        hand_names = [card.name for card in hand]
-        bfield_names = [card.name for card in bfield]
-        
-        tron_needed = tron_check(bfield)
-        if len(tron_needed) == 0 and manapool >= 3:
+        if not bfield.tron_missing and manapool >= 3:
             return(True)
         
-        priority = (('Expedition Map', 'ability'), ('Sylvan Scrying', 'cast'), 
-                    ('Expedition Map', 'cast'), ('Ancient Stirrings', 'cast'), ('OUaT', 'cast'),
-                    ('Chromatic Star', 'ability'), ('Chromatic Sphere', 'ability'),
-                    ('Chromatic Star', 'cast'), ('Chromatic Sphere', 'cast'),
-                    ('Relic of Progenitus', 'ability'), ('Relic of Progenitus', 'cast'),
-                    ('Forest', 'play'), ('Ghost Quarter', 'play'), ('Sanctum of Ugin', 'play'),
-                    ('Urza\'s Tower', 'play'), ('Urza\'s Mine', 'play'), ('Urza\'s Power Plant', 'play'))
-        
         # play a tron land from hand if already available
-        for card_name in list(tron_needed):
-            if card_name in hand_names and land_drop is False:
-                card = hand[hand_names.index(card_name)]
-                card.play(hand, bfield)
-                
-                #update hand names and remaining tron pieces needed
-                hand_names.pop(hand_names.index(card_name))
-                tron_needed = tron_check(bfield)
-                
+        for cid in MISSING_TRON[bfield.tron_missing]:
+            if in_hand[cid] and land_drop is False:
+                CARDS[cid].play(hand, bfield)
+        
                 manapool += 1
                 
-                if len(tron_needed) == 0 and manapool >= 3:
+                if not bfield.tron_missing and manapool >= 3:
                     return(True)
                     
                 land_drop = True
@@ -129,17 +120,14 @@ def sim_turn(hand, deck, bfield, turn):
                 break
         
         # play a card and return to the top of the loop 
-        for card in priority:
-            
-            field = card[1]
-            name = card[0]
+        for cid, field in PRIORITY:
             
             # for activated abilities of cards in play
-            if field == 'ability' and name in bfield_names:
-                card = bfield[bfield_names.index(name)]
-                if manapool >= card.amc:
+            if field == 'ability' and in_play[cid]:
+                if manapool >= AMC[cid]:
+                    card = CARDS[cid]
                     card.ability(hand, deck, bfield)
-                    manapool -= card.amc
+                    manapool -= AMC[cid]
                     if type(card) == Chromatic:
                         manapool += 1
                         g_mana += 1
@@ -147,36 +135,35 @@ def sim_turn(hand, deck, bfield, turn):
                     break
             
             # for casting a spell in hand
-            if field == 'cast' and name in hand_names:
-                card = hand[hand_names.index(name)]
-                if manapool >= card.cmc and g_mana >= card.gmc:
-                    card.cast(hand, deck, bfield)
-                    manapool -= card.cmc
-                    g_mana -= card.gmc
+            if field == 'cast' and in_hand[cid]:
+                if manapool >= CMC[cid] and g_mana >= GMC[cid]:
+                    CARDS[cid].cast(hand, deck, bfield)
+                    manapool -= CMC[cid]
+                    g_mana -= GMC[cid]
                     plays = True
                     break
             
             # for playing a land that's not a missing Tron land (last option)
-            if field == 'play' and name in hand_names and land_drop is False:
-                card = hand[hand_names.index(name)]
-                card.play(hand, bfield)
+            if field == 'play' and in_hand[cid] and land_drop is False:
+                CARDS[cid].play(hand, bfield)
                 plays = True
                 land_drop = True
                 manapool += 1
-                if card.name == 'Forest':
-                    g_mana += 1
+                g_mana += IS_GREEN_SOURCE[cid]
                 break
             
     return(False)
 
 
-def sim_magic(handsize, on_draw):
+def sim_magic(handsize, on_draw, rng = None, deck = None):
     '''
     handsize: starting handsize (int)
     on_draw: boolean
+    rng: random.Random or numpy Generator (defaults to the random module)
+    deck: card_classes.Deck to play, defaults to the Tron deck list
     '''
-    library = TronDeck()
-    bfield = []
+    library = TronDeck(rng, deck)
+    bfield = Battlefield()
     
     hand = library.draw_opener(handsize)
     starting_hand = [card.name for card in hand]
@@ -203,36 +190,157 @@ def sim_magic(handsize, on_draw):
     return (starting_hand, turn)
 
 
-def estimate_turns(on_draw):
+# simulates n games, for use with parallel.run_sharded
+def sim_games(handsize, on_draw, n, rng = None):
+    return [sim_magic(handsize, on_draw, rng) for i in range(n)]
+
+# turns to achieve Tron in n games, for use with parallel.run_sharded
+def sim_game_turns(handsize, on_draw, n, rng = None):
+    return [sim_magic(handsize, on_draw, rng)[1] for i in range(n)]
+
+# sim_game_turns with another deck (a card_classes.Deck)
+def sim_deck_turns(deck, handsize, on_draw, n, rng = None):
+    return [sim_magic(handsize, on_draw, rng, deck)[1] for i in range(n)]
+
+# turns to achieve Tron in n trials that play both arms, each a 
+# (handsize, on_draw) pair, with the same shuffled library
+def paired_game_turns(arm_a, arm_b, n, rng = None):
+    
+    if rng is None:
+        rng = random
+    
+    turns = []
+    for i in range(n):
+        deck_seed = rng.getrandbits(64)
+        turns.append((sim_magic(*arm_a, random.Random(deck_seed))[1],
+                      sim_magic(*arm_b, random.Random(deck_seed))[1]))
+    
+    return turns
+
+def compare_turns(arm_a, arm_b, n, seed = None, workers = 1):
+    '''
+    paired comparison of turns to achieve Tron on common random numbers
+    arm_a, arm_b -- (handsize, on_draw) e.g. (7, False) vs (7, True) for
+                    play vs draw, or (7, True) vs (6, True) for a mulligan
+    n -- (int) number of trials
+    
+    returns an adaptive.Comparison
+    '''
+    pairs = run_cached(paired_game_turns, n, args = (arm_a, arm_b), 
+                       seed = seed, workers = workers)
+    return paired_difference(pairs)
+
+# turns to achieve Tron for n games (cached on disk when seeded)
+def sim_turns(handsize, on_draw, n, seed = None, workers = 1):
+    turns = run_cached(sim_game_turns, n, args = (handsize, on_draw), 
+                       seed = sub_seed(seed, handsize, int(on_draw)), 
+                       workers = workers)
+    return turns.tolist()
+
+
+# distribution of the turn on which Tron is achieved
+class TurnHistogram:
+    
+    def __init__(self, turns):
+        # counts[t] is the number of games that achieved Tron on turn t
+        self.counts = np.bincount(turns)
+        self.n = int(self.counts.sum())
+        self.turns = np.arange(len(self.counts))
+    
+    def pmf(self, k):
+        # P(T = k)
+        return self.counts[k] / self.n if k < len(self.counts) else 0.0
+    
+    def cdf(self, k):
+        # P(T <= k)
+        return self.counts[:k+1].sum() / self.n
+    
+    def mean(self):
+        return (self.turns * self.counts).sum() / self.n
+    
+    def std(self):
+        var = ((self.turns - self.mean())**2 * self.counts).sum() / self.n
+        return np.sqrt(var)
+    
+    def quantile(self, q):
+        # smallest turn k with P(T <= k) >= q
+        return int(np.searchsorted(self.counts.cumsum(), q * self.n))
+
+
+# turn histograms for each handsize, from one simulation pass
+def turn_histograms(on_draw, n, seed = None, workers = 1):
+    return {i: TurnHistogram(sim_turns(i, on_draw, n, seed, workers))
+            for i in range(7, 2, -1)}
+
+
+def estimate_turns(on_draw, seed = None, workers = 1, histograms = None):
     # on_draw -- True/False
+    # histograms -- output of turn_histograms, simulated if not given
+    if histograms is None:
+        histograms = turn_histograms(on_draw, 5000, seed, workers)
     
-    for i in range(7, 2, -1):
-        turns = []
-        for n in range(5000):
-            res = sim_magic(i, on_draw)
-            turns.append(res[1])
-        #return np.mean(turns), np.std(turns)
-        print(i, 'card hand:', np.mean(turns), 'turns')
-
-def turn3_estimate(on_draw, n):
+    for i, hist in histograms.items():
+        #return hist.mean(), hist.std()
+        print(i, 'card hand:', hist.mean(), 'turns')
+
+def turn3_estimate(on_draw, n, seed = None, workers = 1, histograms = None):
     # on_draw -- True/False
-    for i in range(7, 2, -1):
-        turns = []
-        for num in range(n):
-            res = sim_magic(i, on_draw)
-            turns.append(res[1])
-        #return np.mean(turns), np.std(turns)
-        print(i, 'card hand:', turns.count(3)/n)
+    if histograms is None:
+        histograms = turn_histograms(on_draw, n, seed, workers)
+    
+    for i, hist in histograms.items():
+        print(i, 'card hand:', hist.pmf(3))
         
-def turn4_estimate(on_draw, n):
+def turn4_estimate(on_draw, n, seed = None, workers = 1, histograms = None):
     # on_draw -- True/False
+    if histograms is None:
+        histograms = turn_histograms(on_draw, n, seed, workers)
+    
+    for i, hist in histograms.items():
+        print(i, 'card hand:', round(hist.pmf(3) + hist.pmf(4), 3))
+
+# all three estimates from a single set of simulations
+def turn_report(on_draw, n, seed = None, workers = 1):
+    
+    histograms = turn_histograms(on_draw, n, seed, workers)
+    print('average turns to Tron:')
+    estimate_turns(on_draw, histograms = histograms)
+    print('turn 3 Tron:')
+    turn3_estimate(on_draw, n, histograms = histograms)
+    print('Tron by turn 4:')
+    turn4_estimate(on_draw, n, histograms = histograms)
+    
+    return histograms
+    
+
+# per-game values averaged by adaptive_turns
+TURN_STATISTICS = {'mean': lambda turns: turns,
+                   'turn3': lambda turns: turns == 3,
+                   'turn4': lambda turns: (turns == 3) | (turns == 4)}
+
+def adaptive_turns(on_draw, half_width, statistic = 'mean', seed = None, 
+                   workers = 1, confidence = 0.95):
+    '''
+    simulates each handsize until its estimate is within half_width
+    on_draw -- True/False
+    half_width -- (float) target confidence interval half-width
+    statistic -- 'mean' (turns to Tron), 'turn3' (share of turn 3 Tron) 
+                 or 'turn4' (share of Tron by turn 4)
+    
+    returns {handsize: adaptive.Estimate}
+    '''
+    estimates = {}
     for i in range(7, 2, -1):
-        turns = []
-        for num in range(n):
-            res = sim_magic(i, on_draw)
-            turns.append(res[1])
-        #return np.mean(turns), np.std(turns)
-        print(i, 'card hand:', round(turns.count(3)/n + turns.count(4)/n, 3))
+        estimates[i] = sequential_estimate(
+                sim_game_turns, half_width, args = (i, on_draw),
+                transform = TURN_STATISTICS[statistic],
+                seed = sub_seed(seed, i, int(on_draw)), workers = workers,
+                confidence = confidence)
+        print(i, 'card hand:', round(estimates[i].mean, 3), '+/-', 
+              round(estimates[i].half_width, 3), 
+              '({0} games)'.format(estimates[i].n))
+    
+    return estimates
     
 
 def main():
@@ -242,7 +350,8 @@ def main():
         if draw in options: break
         else: print('input must be y or n')
     print('simulating hands:')
-    estimate_turns(options[draw])
+    # seeded so repeated runs are read from the simulation cache
+    estimate_turns(options[draw], seed = 0)
     
     
 if __name__ == '__main__':